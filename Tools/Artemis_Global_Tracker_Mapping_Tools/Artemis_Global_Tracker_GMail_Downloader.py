@@ -17,6 +17,10 @@
 # Follow these instructions to create your credentials for the API:
 # https://developers.google.com/gmail/api/quickstart/python
 
+# The GMail API service object is created once and used for all checks. The credentials
+# are only refreshed when they have expired, and the discovery document describing the
+# API is cached in discovery_cache.json, so a check for new messages costs just one request.
+
 # If modifying these scopes, delete the file token.pickle.
 #SCOPES = ['https://www.googleapis.com/auth/gmail.readonly'] # Read only
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify'] # Everything except delete
@@ -24,11 +28,47 @@ SCOPES = ['https://www.googleapis.com/auth/gmail.modify'] # Everything except de
 
 import base64
 import pickle
+import json
 import os.path
 from googleapiclient.discovery import build
+from googleapiclient.discovery_cache.base import Cache
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from time import sleep
+from time import sleep, time
+
+DISCOVERY_CACHE_FILE = 'discovery_cache.json'
+DISCOVERY_CACHE_MAX_AGE = 7 * 24 * 60 * 60 # Fetch the discovery document again after a week (seconds)
+
+class DiscoveryCache(Cache):
+    """Stores the API discovery documents in a file, so build() does not fetch them again.
+
+    Args:
+        filename: Name of the cache file.
+        max_age: Documents older than this (in seconds) are fetched again.
+    """
+
+    def __init__(self, filename=DISCOVERY_CACHE_FILE, max_age=DISCOVERY_CACHE_MAX_AGE):
+        self.filename = filename
+        self.max_age = max_age
+
+    def _load(self):
+        try:
+            with open(self.filename, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, url):
+        entry = self._load().get(url)
+        if entry is None or time() - entry['time'] > self.max_age:
+            return None
+        return entry['content']
+
+    def set(self, url, content):
+        entries = self._load()
+        entries[url] = {'time': time(), 'content': content}
+        with open(self.filename, 'w') as f:
+            json.dump(entries, f)
 
 def get_credentials():
     """Gets valid user credentials from storage.
@@ -56,10 +96,51 @@ def get_credentials():
                 'credentials.json', SCOPES)
             creds = flow.run_local_server(port=0)
         # Save the credentials for the next run
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
+        save_credentials(creds)
     return creds
 
+def save_credentials(creds):
+    """Saves the credentials in token.pickle for the next run.
+
+    Args:
+        creds: Credentials, as returned by get_credentials().
+    """
+    with open('token.pickle', 'wb') as token:
+        pickle.dump(creds, token)
+
+def refresh_credentials(creds):
+    """Refreshes the credentials if they have expired and saves them.
+
+    Valid credentials are left alone, so this costs nothing between expiries.
+    The Label_IDs found by GetLabelId are looked up again after a refresh.
+
+    Args:
+        creds: Credentials, as returned by get_credentials().
+
+    Returns:
+        True if the credentials were refreshed.
+    """
+    if creds.expired and creds.refresh_token:
+        creds.refresh(Request())
+        save_credentials(creds)
+        label_ids.clear()
+        return True
+    return False
+
+def GetService(creds):
+    """Creates a Gmail API service object, using the discovery document cached on disk.
+
+    The Label_IDs found by GetLabelId are forgotten, as the service may be for another account.
+
+    Args:
+        creds: Credentials, as returned by get_credentials().
+
+    Returns:
+        Authorized Gmail API service instance.
+    """
+    label_ids.clear()
+    return build('gmail', 'v1', credentials=creds, cache=DiscoveryCache())
+
 def ListMessagesMatchingQuery(service, user_id, query=''):
     """List all Messages of the user's mailbox matching the query.
 
@@ -195,25 +276,49 @@ def MoveToLabel(service, user_id, msg_id, dest):
         msg_id: ID of Message.
         dest: destination label
     """
-    # Find Label_ID of destination label
-    results = service.users().labels().list(userId=user_id).execute()
-    labels = results.get('labels', [])
-    for label in labels:
-        if label['name'] == dest: dest_id = label['id']
+    dest_id = GetLabelId(service, user_id, dest)
 
     service.users().messages().modify(userId=user_id, id=msg_id, body={ 'addLabelIds': [dest_id]}).execute()
     service.users().messages().modify(userId=user_id, id=msg_id, body={ 'removeLabelIds': ['INBOX']}).execute()
 
-def main():
-    """Creates a Gmail API service object.
+label_ids = {} # Label_IDs found by GetLabelId
+
+def GetLabelId(service, user_id, name):
+    """Returns the Label_ID of the label with given name.
+
+    The labels are only listed the first time a name is looked up,
+    or again after GetService or refresh_credentials.
+
+    Args:
+        service: Authorized Gmail API service instance.
+        user_id: User's email address. The special value "me"
+        can be used to indicate the authenticated user.
+        name: label name
+
+    Raises:
+        ValueError: if there is no label with that name.
+    """
+    if name not in label_ids:
+        results = service.users().labels().list(userId=user_id).execute()
+        for label in results.get('labels', []):
+            if label['name'] == name: label_ids[name] = label['id']
+    if name not in label_ids:
+        raise ValueError('Label "{}" not found. Please create it in GMail first.'.format(name))
+    return label_ids[name]
+
+def main(service=None):
+    """Uses the given Gmail API service object, or creates one.
     Searches for unread messages, with attachments, with "Message" "from RockBLOCK" in the subject.
     Saves the attachment to disk.
     Marks the message as read.
     Moves it to the SBD folder.
     You will need to create the SBD folder in GMail if it doesn't already exist.
+
+    Args:
+        service: Authorized Gmail API service instance, see GetService().
     """
-    creds = get_credentials()
-    service = build('gmail', 'v1', credentials=creds)
+    if service is None:
+        service = GetService(get_credentials())
 
     # Include your RockBLOCK IMEI in the subject search if required
     messages = ListMessagesMatchingQuery(service, 'me', 'subject:(Message \"from RockBLOCK\") is:unread has:attachment')
@@ -231,9 +336,12 @@ if __name__ == '__main__':
     print('Artemis Global Tracker: GMail API Downloader')
     print('Press Ctrl-C to quit')
     try:
+        creds = get_credentials()
+        service = GetService(creds) # Use the same service object for all checks
         while True:
             #print('Checking for messages...')
-            main()
+            refresh_credentials(creds)
+            main(service)
             for i in range(15):
                 sleep(1) # Sleep
     except KeyboardInterrupt:
@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local IMAP stand-in server for the Artemis Global Tracker Message Translator
+
+License: MIT
+
+A small IMAP server keeping RockBLOCK-style mails in memory, so the IMAP functions of the
+Message Translator (query_mail, get_messages, sync_mail, watch_mail, ingest_mailboxes) can be
+tested and benchmarked offline. It implements just what the translator uses: LOGIN, SELECT and
+EXAMINE (with UIDVALIDITY, UIDNEXT and HIGHESTMODSEQ), SEARCH (FROM, UNSEEN, UID), FETCH
+(UID, FLAGS, RFC822, BODY[...], BODY.PEEK[...], BODYSTRUCTURE), STORE, IDLE, ENABLE, CLOSE
+and LOGOUT, with and without UID. Any user name, password and mailbox name are accepted.
+A delay per command simulates the network round trip to a real server. There is no TLS, so
+connect with imaplib.IMAP4, or add 'ssl = no' and the port to the ini file of the translator.
+
+Run on its own, it serves synthetic mails from the Translator Benchmark, optionally adding
+a new mail every few seconds to try the translator's -w option.
+"""
+
+import email
+import re
+import socketserver
+import threading
+import time
+import argparse
+import multiprocessing
+
+def _quote(value):
+    """
+    Quote a string for an IMAP response, or NIL for None.
+    """
+    if value is None:
+        return 'NIL'
+    return '"{}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"'))
+
+def bodystructure(part):
+    """
+    Build the BODYSTRUCTURE of a parsed email (RFC 3501, section 7.4.2), with disposition.
+
+    Args:
+        part, email.message.Message
+
+    Returns:
+        bodystructure, string
+    """
+    if part.is_multipart():
+        return '({} {} ("boundary" {}) NIL NIL)'.format(''.join(bodystructure(sub) for sub in part.get_payload()),
+                                                        _quote(part.get_content_subtype()), _quote(part.get_boundary()))
+    body = part.get_payload()
+    params = ' '.join('{} {}'.format(_quote(key), _quote(value)) for key, value in part.get_params()[1:])
+    disposition = part.get_content_disposition()
+    if disposition:
+        filename = part.get_filename()
+        disposition = '({} {})'.format(_quote(disposition), '("filename" {})'.format(_quote(filename)) if filename else 'NIL')
+    fields = [_quote(part.get_content_maintype()), _quote(part.get_content_subtype()), '({})'.format(params) if params else 'NIL',
+              'NIL', 'NIL', _quote(part.get('Content-Transfer-Encoding', '7bit')), str(len(body))]
+    if part.get_content_maintype() == 'text':
+        fields.append(str(body.count('\n')))
+    fields += ['NIL', disposition or 'NIL', 'NIL']
+    return '({})'.format(' '.join(fields))
+
+def body_section(message, raw, section):
+    """
+    Get a body section as for BODY[section]: the whole mail for '', otherwise the encoded body of a part, e.g. '2' or '1.2'.
+    """
+    if not section:
+        return raw
+    part = message
+    for ind in section.split('.'):
+        if not part.is_multipart():
+            if ind == '1':
+                continue
+            return b''
+        part = part.get_payload()[int(ind) - 1]
+    return part.get_payload().encode('ascii', errors='replace') if not part.is_multipart() else b''
+
+class StandInMail:
+    """
+    A mail in a StandInMailbox.
+    """
+
+    def __init__(self, uid, raw, modseq):
+        self.uid = uid
+        self.raw = raw
+        self.message = email.message_from_bytes(raw)
+        self.bodystructure = bodystructure(self.message)
+        self.sender = (self.message['From'] or '').lower()
+        self.flags = set()
+        self.modseq = modseq
+
+class StandInMailbox:
+    """
+    Mails of the stand-in server. Mails can be added while clients are connected; clients in IDLE are notified.
+    """
+
+    def __init__(self, mails=(), uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.modseq = 1
+        self.mails = []
+        self.changed = threading.Condition()
+        for raw in mails:
+            self.add(raw)
+
+    def add(self, raw):
+        """
+        Add a mail, given as raw RFC822 bytes.
+
+        Returns:
+            uid, UID of the new mail
+        """
+        with self.changed:
+            self.modseq += 1
+            uid = self.mails[-1].uid + 1 if self.mails else 1
+            self.mails.append(StandInMail(uid, raw, self.modseq))
+            self.changed.notify_all()
+        return uid
+
+    def reset_flags(self):
+        """
+        Mark all mails as unseen again.
+        """
+        with self.changed:
+            for mail in self.mails:
+                mail.flags.clear()
+            self.modseq += 1
+
+    def snapshot(self):
+        """
+        Returns:
+            mails, list of (message number, StandInMail)
+        """
+        with self.changed:
+            return list(enumerate(self.mails, 1))
+
+"""
+Items of a FETCH command the stand-in server understands.
+"""
+FETCH_ITEM = re.compile(r'UID|FLAGS|RFC822|BODYSTRUCTURE|BODY(?:\.PEEK)?\[([\d.]*)\]', re.IGNORECASE)
+
+"""
+Arguments of a command: quoted strings, parenthesized lists (flattened) and atoms.
+"""
+COMMAND_ARGUMENT = re.compile(r'"((?:[^"\\]|\\.)*)"|([^\s()"]+)')
+
+def _message_numbers(message_set, numbers):
+    """
+    Select the numbers (message numbers or UIDs) in an IMAP message set like 1:3,7,9:*.
+    """
+    largest = max(numbers) if numbers else 0
+    ranges = []
+    for item in message_set.split(','):
+        first, colon, last = item.partition(':')
+        first = largest if first == '*' else int(first)
+        last = first if not colon else (largest if last == '*' else int(last))
+        ranges.append((min(first, last), max(first, last)))
+    return set(num for num in numbers if any(first <= num <= last for first, last in ranges))
+
+class _StandInHandler(socketserver.StreamRequestHandler):
+    """
+    One client connection of the stand-in server.
+    """
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.server.count_bytes(len(data))
+        self.wfile.write(data)
+
+    def handle(self):
+        self.exists = None # number of mails last reported to the client
+        self.send('* OK [CAPABILITY IMAP4rev1 IDLE ENABLE CONDSTORE] Artemis Global Tracker IMAP stand-in ready\r\n')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, command = line.decode(errors='replace').rstrip('\r\n').partition(' ')
+            name, _, args = command.partition(' ')
+            name = name.upper()
+            uid = name == 'UID'
+            if uid:
+                name, _, args = args.partition(' ')
+                name = name.upper()
+            self.server.count_command()
+            handler = getattr(self, 'do_' + name, None)
+            if handler is None:
+                self.send('{} BAD Unknown command\r\n'.format(tag))
+            elif handler(tag, args, uid) is False:
+                return
+
+    def do_CAPABILITY(self, tag, args, uid):
+        self.send('* CAPABILITY IMAP4rev1 IDLE ENABLE CONDSTORE\r\n{} OK CAPABILITY completed\r\n'.format(tag))
+
+    def do_LOGIN(self, tag, args, uid):
+        self.send('{} OK LOGIN completed\r\n'.format(tag))
+
+    def do_NOOP(self, tag, args, uid):
+        with self.server.mailbox.changed:
+            exists = len(self.server.mailbox.mails)
+        if self.exists is not None and exists != self.exists: # report new mails like IDLE
+            self.send('* {} EXISTS\r\n'.format(exists))
+        self.exists = exists
+        self.send('{} OK NOOP completed\r\n'.format(tag))
+
+    def do_ENABLE(self, tag, args, uid):
+        self.send('{} OK completed\r\n'.format(tag))
+
+    do_CHECK = do_CLOSE = do_ENABLE
+
+    def do_LOGOUT(self, tag, args, uid):
+        self.send('* BYE Logging out\r\n{} OK LOGOUT completed\r\n'.format(tag))
+        return False
+
+    def do_SELECT(self, tag, args, uid, readonly=False):
+        box = self.server.mailbox
+        mails = box.snapshot()
+        self.exists = len(mails)
+        uidnext = mails[-1][1].uid + 1 if mails else 1
+        self.send('* {} EXISTS\r\n* 0 RECENT\r\n* FLAGS (\\Seen)\r\n* OK [UIDVALIDITY {}] UIDs valid\r\n* OK [UIDNEXT {}] Predicted next UID\r\n'
+                  '* OK [HIGHESTMODSEQ {}] Highest\r\n{} OK [{}] SELECT completed\r\n'.format(
+                  len(mails), box.uidvalidity, uidnext, box.modseq, tag, 'READ-ONLY' if readonly else 'READ-WRITE'))
+
+    def do_EXAMINE(self, tag, args, uid):
+        self.do_SELECT(tag, args, uid, readonly=True)
+
+    def do_SEARCH(self, tag, args, uid):
+        tokens = [match.group(1) if match.group(1) is not None else match.group(2) for match in COMMAND_ARGUMENT.finditer(args)]
+        mails = self.server.mailbox.snapshot()
+        if tokens and tokens[0].upper() == 'CHARSET':
+            tokens = tokens[2:]
+        selected = mails
+        ind = 0
+        while ind < len(tokens):
+            key = tokens[ind].upper()
+            if key == 'FROM':
+                sender = tokens[ind + 1].lower()
+                selected = [(num, mail) for num, mail in selected if sender in mail.sender]
+                ind += 2
+            elif key == 'UNSEEN':
+                selected = [(num, mail) for num, mail in selected if '\\Seen' not in mail.flags]
+                ind += 1
+            elif key == 'UID':
+                uids = _message_numbers(tokens[ind + 1], [mail.uid for _, mail in mails])
+                selected = [(num, mail) for num, mail in selected if mail.uid in uids]
+                ind += 2
+            else: # ALL and anything unsupported
+                ind += 1
+        found = ''.join(' {}'.format(mail.uid if uid else num) for num, mail in selected)
+        self.send('* SEARCH{}\r\n{} OK SEARCH completed\r\n'.format(found, tag))
+
+    def do_FETCH(self, tag, args, uid):
+        message_set, _, items = args.partition(' ')
+        mails = self.server.mailbox.snapshot()
+        wanted = _message_numbers(message_set, [mail.uid if uid else num for num, mail in mails])
+        items = [(match.group(0).upper(), match.group(1)) for match in FETCH_ITEM.finditer(items)]
+        if uid and 'UID' not in (item for item, _ in items):
+            items.insert(0, ('UID', None))
+        response = []
+        for num, mail in mails:
+            if (mail.uid if uid else num) not in wanted:
+                continue
+            parts = []
+            for item, section in items:
+                if item == 'UID':
+                    parts.append('UID {}'.format(mail.uid).encode())
+                elif item == 'FLAGS':
+                    parts.append('FLAGS ({})'.format(' '.join(sorted(mail.flags))).encode())
+                elif item == 'BODYSTRUCTURE':
+                    parts.append('BODYSTRUCTURE {}'.format(mail.bodystructure).encode())
+                else:
+                    if item == 'RFC822':
+                        name, body = 'RFC822', mail.raw
+                    else:
+                        name, body = 'BODY[{}]'.format(section), body_section(mail.message, mail.raw, section)
+                    if '.PEEK' not in item:
+                        mail.flags.add('\\Seen')
+                    parts.append('{} {{{}}}\r\n'.format(name, len(body)).encode() + body)
+            response.append('* {} FETCH ('.format(num).encode() + b' '.join(parts) + b')\r\n')
+        response.append('{} OK FETCH completed\r\n'.format(tag).encode())
+        self.send(b''.join(response))
+
+    def do_STORE(self, tag, args, uid):
+        message_set, _, change = args.partition(' ')
+        box = self.server.mailbox
+        mails = box.snapshot()
+        wanted = _message_numbers(message_set, [mail.uid if uid else num for num, mail in mails])
+        mode, _, flags = change.partition(' ')
+        flags = set(re.findall(r'\\?\w+', flags))
+        with box.changed:
+            for num, mail in mails:
+                if (mail.uid if uid else num) in wanted:
+                    if mode.upper().startswith('+FLAGS'):
+                        mail.flags |= flags
+                    elif mode.upper().startswith('-FLAGS'):
+                        mail.flags -= flags
+                    else:
+                        mail.flags = set(flags)
+                    box.modseq += 1
+                    mail.modseq = box.modseq
+        self.send('{} OK STORE completed\r\n'.format(tag))
+
+    def do_IDLE(self, tag, args, uid):
+        box = self.server.mailbox
+        self.send('+ idling\r\n')
+        done = threading.Event()
+        with box.changed:
+            known = len(box.mails)
+        def notify():
+            with box.changed:
+                while not done.is_set():
+                    if len(box.mails) > known:
+                        try:
+                            self.send('* {} EXISTS\r\n'.format(len(box.mails)))
+                        except OSError:
+                            pass
+                        return
+                    box.changed.wait(0.1)
+        notifier = threading.Thread(target=notify, daemon=True)
+        notifier.start()
+        line = self.rfile.readline() # DONE
+        done.set()
+        notifier.join()
+        if not line:
+            return False
+        self.send('{} OK IDLE terminated\r\n'.format(tag))
+
+class StandInServer(socketserver.ThreadingTCPServer):
+    """
+    The stand-in IMAP server, serving a StandInMailbox in a background thread. Use as context manager:
+
+        with StandInServer(StandInMailbox(mails)) as server:
+            imap = imaplib.IMAP4(*server.address)
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, mailbox, host='127.0.0.1', port=0, delay=0.0):
+        """
+        Args:
+            mailbox, StandInMailbox to serve
+            host, port, address to listen on (port 0: any free port)
+            delay, time in s each command waits before it is answered, like a network round trip
+        """
+        super().__init__((host, port), _StandInHandler)
+        self.mailbox = mailbox
+        self.delay = delay
+        self._lock = threading.Lock()
+        self.reset_stats()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def address(self):
+        return self.server_address[:2]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def stop(self):
+        """
+        Stop serving and close the listening socket.
+        """
+        self.shutdown()
+        self.server_close()
+
+    def reset_stats(self):
+        """
+        Reset the counters of commands and bytes sent.
+        """
+        with self._lock:
+            self.commands = 0
+            self.bytes_sent = 0
+
+    def stats(self):
+        """
+        Returns:
+            commands, number of commands received since the last reset_stats()
+            bytes_sent, number of bytes sent since the last reset_stats()
+        """
+        with self._lock:
+            return self.commands, self.bytes_sent
+
+    def count_command(self):
+        with self._lock:
+            self.commands += 1
+        if self.delay:
+            time.sleep(self.delay)
+
+    def count_bytes(self, size):
+        with self._lock:
+            self.bytes_sent += size
+
+def _serve(connection, mails, delay):
+    """
+    Run a StandInServer in a child process, controlled through a multiprocessing connection.
+    """
+    with StandInServer(StandInMailbox(mails), delay=delay) as server:
+        calls = {'stats': server.stats, 'reset_stats': server.reset_stats,
+                 'reset_flags': server.mailbox.reset_flags, 'add': server.mailbox.add}
+        connection.send(server.address)
+        while True:
+            name, args = connection.recv()
+            if name == 'stop':
+                break
+            connection.send(calls[name](*args))
+
+class StandInProcess:
+    """
+    A StandInServer running in its own process, so that serving does not compete with the
+    client for the GIL, e.g. in benchmarks. Offers the same address, stats(), reset_stats(),
+    reset_flags() and add() as StandInServer and its mailbox.
+    """
+
+    def __init__(self, mails=(), delay=0.0):
+        self._connection, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, args=(child, list(mails), delay), daemon=True)
+        self._process.start()
+        self.address = self._connection.recv()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _call(self, name, *args):
+        self._connection.send((name, args))
+        return self._connection.recv()
+
+    def stats(self):
+        return self._call('stats')
+
+    def reset_stats(self):
+        return self._call('reset_stats')
+
+    def reset_flags(self):
+        return self._call('reset_flags')
+
+    def add(self, raw):
+        return self._call('add', raw)
+
+    def stop(self):
+        """
+        Stop the server and its process.
+        """
+        if self._process.is_alive():
+            self._connection.send(('stop', ()))
+            self._process.join()
+
+if __name__ == "__main__":
+    import Artemis_Global_Tracker_Translator_Benchmark as benchmark
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--count', required=False, type=int, default=1000, help='Number of synthetic mails to start with (default: 1000)')
+    parser.add_argument('-p', '--port', required=False, type=int, default=1143, help='Port to listen on (default: 1143)')
+    parser.add_argument('-x', '--mix', required=False, default='default', choices=list(benchmark.MOFIELDS_MIXES), help='MOFIELDS mix of the messages (default: default)')
+    parser.add_argument('-d', '--delay', required=False, type=float, default=0.0, help='Delay per command in s, simulating the round trip to a real server (default: 0)')
+    parser.add_argument('-e', '--every', required=False, type=float, default=None, help='Add a new mail every this many seconds')
+    parser.add_argument('--seed', required=False, type=int, default=0, help='Seed for the synthetic messages (default: 0)')
+    args = parser.parse_args()
+    fields = benchmark.MOFIELDS_MIXES[args.mix]
+    messages, _ = benchmark.binary_corpus(fields, args.count, seed=args.seed)
+    with StandInServer(StandInMailbox(benchmark.mail_corpus(messages)), port=args.port, delay=args.delay) as server:
+        print('Serving {} mails on {}:{}, stop with Ctrl-C'.format(args.count, *server.address))
+        try:
+            seed = args.seed
+            while True:
+                if args.every is None:
+                    time.sleep(3600)
+                    continue
+                time.sleep(args.every)
+                seed += 1
+                messages, _ = benchmark.binary_corpus(fields, 1, seed=seed)
+                uid = server.mailbox.add(benchmark.mail_corpus(messages)[0])
+                print('Added mail with UID {}'.format(uid))
+        except KeyboardInterrupt:
+            pass
@@ -10,20 +10,42 @@ License: MIT
 
 This code translates binary SBD messages by the Artemis Global Tracker.
 Messages can be read from local files or from email attachments on an IMAP server.
+Text messages can be translated as well, given the MOFIELDS setting of the tracker.
 Optionally, the coordinates of all messages can be written into a GPX file.
+In bulk mode, whole directory trees or mail exports (mbox, Maildir) are translated in parallel into one NDJSON, CSV or GPX file.
 """
 
 import numpy as np
 from enum import Enum
 import datetime
 import struct
+import math
 import gpxpy
 import gpxpy.gpx
+import gpxpy.gpxfield
+from xml.sax.saxutils import escape
 import configparser
 import imaplib
+import select
+import asyncio
+import threading
 import email
+import email.parser
+import base64
+import quopri
 import os.path
+import mmap
 import argparse
+from collections import namedtuple, OrderedDict
+import operator
+import re
+import json
+import sqlite3
+import hashlib
+import time
+import csv
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
 
 class TrackerMessageFields(Enum):
@@ -211,205 +233,3380 @@ CONVERSION_FACTOR = {
         TrackerMessageFields.LOWBATT: 1e-2
 }
 
+"""
+Kinds of decoded fields in FIELD_DECODERS.
+"""
+KIND_SCALAR   = 0 # single value, optionally scaled by CONVERSION_FACTOR
+KIND_ARRAY    = 1 # fixed length array, returned as np.ndarray
+KIND_DATETIME = 2 # YEAR, MONTH, DAY, HOUR, MIN, SEC, returned as datetime.datetime
+KIND_BYTES    = 3 # raw bytes
+KIND_EMPTY    = 4 # field without data, not included in the translated message
+
+FieldDecoder = namedtuple('FieldDecoder', ['name', 'unpacker', 'length', 'scale', 'kind', 'dtype'])
+
+def _compile_field_decoders():
+    """
+    Compile FIELD_TYPE and CONVERSION_FACTOR into a dense table indexed by field ID.
+
+    Returns:
+        decoders, list of 256 entries, either None (unknown field ID) or a FieldDecoder
+    """
+    decoders = [None] * 256
+    for field, field_type in FIELD_TYPE.items():
+        scale = CONVERSION_FACTOR.get(field)
+        dtype = None
+        if isinstance(field_type, int): # length in bytes
+            if field == TrackerMessageFields.DATETIME:
+                unpacker, kind = struct.Struct('<HBBBBB'), KIND_DATETIME
+            elif field_type > 0:
+                unpacker, kind = struct.Struct('<{}s'.format(field_type)), KIND_BYTES
+            else:
+                unpacker, kind = None, KIND_EMPTY
+            length = field_type
+        elif isinstance(field_type, np.dtype): # dtype of scalar
+            unpacker, kind, dtype = struct.Struct('<' + field_type.char), KIND_SCALAR, field_type
+            length = field_type.itemsize
+        elif isinstance(field_type, tuple): # dtype and length of array
+            dtype = field_type[0]
+            unpacker, kind = struct.Struct('<{}{}'.format(field_type[1], dtype.char)), KIND_ARRAY
+            length = dtype.itemsize * field_type[1]
+        else:
+            raise ValueError('Unknown entry in FIELD_TYPE list: {}'.format(field_type))
+        assert (unpacker is None or unpacker.size == length), 'Size mismatch for field {}.'.format(field.name)
+        decoders[field.value] = FieldDecoder(field.name, unpacker, length, scale, kind, dtype)
+    return decoders
+
+FIELD_DECODERS = _compile_field_decoders()
+
+"""
+Byte count below which checksum() does not use NumPy.
+"""
+CHECKSUM_LOOP_MAX = 160
+
+def _as_uint8(data):
+    """
+    View a bytes-like object (or sequence of ints) as a uint8 array, without copying if possible.
+    """
+    if isinstance(data, np.ndarray):
+        return data.astype(np.uint8, copy=False).ravel()
+    try:
+        return np.frombuffer(data, dtype=np.uint8)
+    except TypeError:
+        return np.asarray(data, dtype=np.uint8)
+
 def checksum(data):
     """
-    Compute checksum bytes are as defined in the 8-Bit Fletcher Algorithm,
-    used by the TCP standard (RFC 1145).
+    Compute checksum bytes are as defined in the 8-Bit Fletcher Algorithm,
+    used by the TCP standard (RFC 1145).
+
+    cs_a is the sum of all bytes and cs_b the sum of all running sums of cs_a,
+    both modulo 256. Both are computed with cumulative sums on a uint64 array,
+    whose wrap-around is harmless because 2**64 is a multiple of 256.
+
+    Short byte arrays, like single SBD messages, are summed in a plain loop instead,
+    as the NumPy call overhead dominates below CHECKSUM_LOOP_MAX bytes.
+
+    Args:
+        data, byte array of data
+
+    Return:
+        cs_a, checksum a
+        cs_b, checksum b
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)) and len(data) < CHECKSUM_LOOP_MAX:
+        cs_a = 0
+        cs_b = 0
+        for byte in data:
+            cs_a += byte
+            cs_b += cs_a
+        return np.uint8(cs_a & 0xff), np.uint8(cs_b & 0xff)
+    running = np.cumsum(_as_uint8(data), dtype=np.uint64)
+    if running.size == 0:
+        return np.uint8(0), np.uint8(0)
+    return np.uint8(running[-1] & 0xff), np.uint8(running.sum(dtype=np.uint64) & 0xff)
+
+def _batch_buffer(messages, lengths=None, offsets=None):
+    """
+    Bring the different batch input layouts into one flat uint8 buffer plus offsets and lengths.
+
+    Args:
+        messages, one of
+            - a sequence of byte arrays,
+            - a 2D uint8 array with one (zero padded) message per row,
+            - a 1D buffer holding all messages back to back (offsets and lengths required)
+        lengths, number of valid bytes per message (default: whole row / whole byte array)
+        offsets, start of each message in the 1D buffer
+
+    Returns:
+        buf, flat uint8 array
+        offsets, int64 array of message start indices into buf
+        lengths, int64 array of message lengths
+    """
+    if offsets is not None:
+        assert (lengths is not None), 'offsets require lengths.'
+        buf = _as_uint8(messages)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+    elif isinstance(messages, np.ndarray) and messages.ndim == 2:
+        buf = np.ascontiguousarray(messages, dtype=np.uint8).ravel()
+        num, width = messages.shape
+        offsets = np.arange(num, dtype=np.int64) * width
+        if lengths is None:
+            lengths = np.full(num, width, dtype=np.int64)
+        else:
+            lengths = np.asarray(lengths, dtype=np.int64)
+    else:
+        messages = [bytes(msg) for msg in messages]
+        buf = np.frombuffer(b''.join(messages), dtype=np.uint8)
+        lengths = np.fromiter((len(msg) for msg in messages), dtype=np.int64, count=len(messages))
+        offsets = np.cumsum(lengths) - lengths
+    assert (offsets.shape == lengths.shape), 'offsets and lengths must have the same shape.'
+    assert (np.all(lengths >= 0) and np.all(offsets + lengths <= buf.size)), 'Message extends beyond end of buffer.'
+    return buf, offsets, lengths
+
+def checksum_batch(messages, lengths=None, offsets=None):
+    """
+    Compute the 8-Bit Fletcher checksums of many messages in one call.
+
+    Uses the running sums S1 = cumsum(buf) and S2 = cumsum(S1) over the whole buffer.
+    For a message of n bytes starting at o:
+        cs_a = S1[o+n] - S1[o]
+        cs_b = S2[o+n] - S2[o] - n * S1[o]
+    with S1 starting at 0 before the first byte
+    all modulo 256. Gives the same result as checksum() for every message.
+
+    Args:
+        messages, lengths, offsets, see _batch_buffer()
+
+    Returns:
+        cs_a, uint8 array of checksum a per message
+        cs_b, uint8 array of checksum b per message
+    """
+    buf, offsets, lengths = _batch_buffer(messages, lengths=lengths, offsets=offsets)
+    s1 = np.zeros(buf.size + 1, dtype=np.uint64)
+    np.cumsum(buf, dtype=np.uint64, out=s1[1:])
+    s2 = np.cumsum(s1, dtype=np.uint64)
+    ends = offsets + lengths
+    cs_a = s1[ends] - s1[offsets]
+    cs_b = s2[ends] - s2[offsets] - lengths.astype(np.uint64) * s1[offsets]
+    return (cs_a & 0xff).astype(np.uint8), (cs_b & 0xff).astype(np.uint8)
+
+def validate_checksums(messages, lengths=None, offsets=None):
+    """
+    Check the trailing Fletcher checksum of many messages in one call.
+
+    Each message is expected to start with STX and end with its two checksum bytes.
+    The checksum is computed over everything before them. A gateway header must not be
+    included, as it is not covered by the checksum.
+
+    Args:
+        messages, lengths, offsets, see _batch_buffer()
+
+    Returns:
+        valid, boolean array, True for each message whose checksum matches
+    """
+    buf, offsets, lengths = _batch_buffer(messages, lengths=lengths, offsets=offsets)
+    valid = lengths >= 2
+    body_lengths = np.where(valid, lengths - 2, 0)
+    cs_a, cs_b = checksum_batch(buf, lengths=body_lengths, offsets=offsets)
+    ends = offsets[valid] + body_lengths[valid]
+    valid[valid] = (buf[ends] == cs_a[valid]) & (buf[ends + 1] == cs_b[valid])
+    return valid
+
+MessageLayout = namedtuple('MessageLayout', ['signature', 'projection', 'unpacker', 'id_getter', 'ids', 'fields', 'accessors'])
+
+def field_projection(fields):
+    """
+    Check a selection of field names for use as projection.
+    Projections already checked are returned as they are, so callers decoding many
+    messages can pass the result of this function to skip the check.
+
+    Args:
+        fields, iterable of field names, or None for all fields
+
+    Returns:
+        projection, frozenset of field names, or None for all fields
+    """
+    if fields is None or (isinstance(fields, frozenset) and fields in _CHECKED_PROJECTIONS):
+        return fields
+    projection = frozenset(fields)
+    unknown = [name for name in projection if name not in TrackerMessageFields.__members__]
+    if unknown:
+        raise ValueError('Unknown fields: {}'.format(', '.join(sorted(unknown))))
+    _CHECKED_PROJECTIONS.add(projection)
+    return projection
+
+_CHECKED_PROJECTIONS = set()
+
+def compile_layout(signature, projection=None):
+    """
+    Compile a sequence of field IDs into one struct.Struct covering the whole frame,
+    from STX up to and including the two checksum bytes.
+
+    Fields not in the projection are covered by pad bytes, so they are skipped
+    without being unpacked.
+
+    Args:
+        signature, tuple of field IDs between STX and ETX
+        projection, frozenset of the field names to decode (default: all), see field_projection()
+
+    Returns:
+        layout, MessageLayout with
+            unpacker, struct.Struct for the frame
+            id_getter, picks the STX, field ID and ETX bytes from the unpacked values
+            ids, the values id_getter has to return for a matching message
+            fields, list of (name, kind, value index, value count, scale, dtype)
+            accessors, dictionary of (FieldDecoder, byte offset from STX) by field name
+    """
+    fmt = ['<B'] # STX
+    id_positions = [0]
+    ids = [TrackerMessageFields.STX.value]
+    fields = []
+    accessors = {}
+    pos = 1
+    offset = 1
+    for field_id in signature:
+        decoder = FIELD_DECODERS[field_id]
+        if decoder is None:
+            raise ValueError('{} is not a valid field ID.'.format(field_id))
+        fmt.append('B')
+        id_positions.append(pos)
+        ids.append(field_id)
+        pos += 1
+        offset += 1 + decoder.length
+        if decoder.kind == KIND_EMPTY:
+            continue
+        if projection is not None and decoder.name not in projection:
+            fmt.append('{}x'.format(decoder.length))
+            continue
+        accessors[decoder.name] = (decoder, offset - decoder.length)
+        count = len(decoder.unpacker.unpack(bytes(decoder.length)))
+        fmt.append(decoder.unpacker.format[1:])
+        fields.append((decoder.name, decoder.kind, pos, count, decoder.scale, decoder.dtype))
+        pos += count
+    fmt.append('BBB') # ETX, checksum a, checksum b
+    id_positions.append(pos)
+    ids.append(TrackerMessageFields.ETX.value)
+    return MessageLayout(tuple(signature), projection, struct.Struct(''.join(fmt)),
+                         operator.itemgetter(*id_positions), tuple(ids), fields, accessors)
+
+class LayoutCache:
+    """
+    Bounded LRU cache of compiled message layouts, keyed by the sequence of field IDs
+    and the projection.
+
+    Trackers sharing a MOFIELDS setting send messages with the same field sequence.
+    To avoid walking the fields of every message, the layout last seen for a given
+    message length and first field ID is tried first and confirmed by comparing the
+    unpacked ID bytes. Only if that fails are the fields walked to find the signature.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._layouts = OrderedDict()
+        self._hints = {}
+
+    def __len__(self):
+        return len(self._layouts)
+
+    def clear(self):
+        """
+        Drop all compiled layouts and reset the counters.
+        """
+        self._layouts.clear()
+        self._hints.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """
+        Returns:
+            stats, dictionary with hits, misses, evictions, size and maxsize
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self._layouts), 'maxsize': self.maxsize}
+
+    def get(self, signature, projection=None):
+        """
+        Look up the layout of a field sequence, compiling it if it is not cached.
+
+        Args:
+            signature, tuple of field IDs between STX and ETX
+            projection, frozenset of the field names to decode (default: all), see field_projection()
+
+        Returns:
+            layout, MessageLayout as returned by compile_layout()
+        """
+        key = (signature, projection)
+        layout = self._layouts.get(key)
+        if layout is None:
+            self.misses += 1
+            layout = compile_layout(*key)
+            self._layouts[key] = layout
+            if len(self._layouts) > self.maxsize:
+                self._layouts.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+            self._layouts.move_to_end(key)
+        return layout
+
+    def unpack(self, message, ind, projection=None):
+        """
+        Find the layout of the frame starting at message[ind] and unpack it.
+
+        Args:
+            message, binary message as byte array
+            ind, index of the STX byte
+            projection, frozenset of the field names to decode (default: all), see field_projection()
+
+        Returns:
+            layout, the matching MessageLayout
+            values, the unpacked values of the frame
+        """
+        hint_key = (len(message), ind, message[ind+1], projection)
+        layout = self._hints.get(hint_key)
+        # Hints outlive their layouts; only use those whose layout has not been evicted since
+        if layout is not None and (layout.signature, projection) in self._layouts:
+            try:
+                values = layout.unpacker.unpack_from(message, ind)
+            except struct.error:
+                values = None
+            if values is not None and layout.id_getter(values) == layout.ids:
+                self.hits += 1
+                self._layouts.move_to_end((layout.signature, projection))
+                return layout, values
+        layout = self.get(walk_signature(message, ind), projection)
+        if len(self._hints) >= 4 * self.maxsize:
+            self._hints.clear()
+        self._hints[hint_key] = layout
+        try:
+            values = layout.unpacker.unpack_from(message, ind)
+        except struct.error as err:
+            raise IndexError('Message truncated: {}'.format(err))
+        return layout, values
+
+"""
+Layout cache used by translate_sbd() unless another one is given.
+"""
+LAYOUT_CACHE = LayoutCache()
+
+def walk_signature(message, ind):
+    """
+    Walk the fields of a frame and collect their IDs.
+
+    Args:
+        message, binary message as byte array
+        ind, index of the STX byte
+
+    Returns:
+        signature, tuple of field IDs between STX and ETX
+    """
+    decoders = FIELD_DECODERS
+    etx = TrackerMessageFields.ETX.value
+    signature = []
+    ind += 1
+    while (message[ind] != etx):
+        decoder = decoders[message[ind]]
+        if decoder is None:
+            raise ValueError('{} is not a valid field ID.'.format(message[ind]))
+        signature.append(message[ind])
+        ind += 1 + decoder.length
+    return tuple(signature)
+
+def unpack_sbd(message, layout_cache=None, fields=None):
+    """
+    Find the layout of a binary SBD message, unpack it and verify its checksum.
+    The checksum always covers the whole frame, whichever fields are decoded.
+
+    Args:
+        message, binary message as byte array
+        layout_cache, LayoutCache to use (default: LAYOUT_CACHE)
+        fields, optional list of field names to decode; other fields are skipped without being unpacked
+
+    Returns:
+        layout, MessageLayout of the message
+        values, unpacked values, see compile_layout()
+    """
+    if message[0] == TrackerMessageFields.STX.value:
+        ind = 0
+    else: # assuming gateway header
+        ind = 5
+    assert (message[ind] == TrackerMessageFields.STX.value), 'STX marker not found.'
+    if layout_cache is None:
+        layout_cache = LAYOUT_CACHE
+    layout, values = layout_cache.unpack(message, ind, field_projection(fields))
+    cs_a, cs_b = checksum(message[ind:ind + layout.unpacker.size - 2]) # STX to ETX, gateway header excluded
+    assert (values[-2] == cs_a), 'Checksum mismatch.'
+    assert (values[-1] == cs_b), 'Checksum mismatch.'
+    return layout, values
+
+def translate_sbd(message, layout_cache=None, fields=None):
+    """
+    Parse binary SBD message from Sparkfun Artemis Global Tracker.
+
+    Args:
+        message, binary message as byte array
+        layout_cache, LayoutCache to use (default: LAYOUT_CACHE)
+        fields, optional list of field names to decode; other fields are skipped without being unpacked
+
+    Returns:
+        data, translated message as dictionary
+    """
+    data = {}
+    layout, values = unpack_sbd(message, layout_cache, fields)
+    for name, kind, pos, count, scale, dtype in layout.fields:
+        if kind == KIND_SCALAR:
+            data[name] = values[pos] * scale if scale else values[pos]
+        elif kind == KIND_DATETIME:
+            data[name] = datetime.datetime(*values[pos:pos+count])
+        elif kind == KIND_ARRAY:
+            data[name] = np.array(values[pos:pos+count], dtype=dtype)
+        else: # KIND_BYTES
+            data[name] = values[pos]
+    return data
+
+class TrackerMessage:
+    """
+    Compact record of a translated message, an alternative to the dictionaries of translate_sbd().
+
+    Only the raw frame (STX to checksum) and the compiled layout, which is shared by all
+    messages with the same field sequence, are kept. Fields are read as attributes and
+    decoded on access into native Python values: ints, floats with CONVERSION_FACTOR
+    applied, a datetime, bytes, and tuples for array fields like MOFIELDS. Accessing a
+    field not included in the message raises AttributeError.
+
+    For compatibility, a TrackerMessage can be read like the dictionary translate_sbd()
+    returns, e.g. msg['LAT'] or 'PRESS' in msg, and as_dict() returns exactly that dictionary.
+    """
+
+    __slots__ = ('_layout', '_frame')
+
+    def __init__(self, layout, frame):
+        self._layout = layout
+        self._frame = frame
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            decoder, offset = self._layout.accessors[name]
+        except KeyError:
+            raise AttributeError('Field {} not included in message.'.format(name))
+        if decoder.kind == KIND_SCALAR:
+            value = decoder.unpacker.unpack_from(self._frame, offset)[0]
+            return value * decoder.scale if decoder.scale else value
+        if decoder.kind == KIND_DATETIME:
+            return datetime.datetime(*decoder.unpacker.unpack_from(self._frame, offset))
+        if decoder.kind == KIND_ARRAY:
+            return decoder.unpacker.unpack_from(self._frame, offset)
+        return decoder.unpacker.unpack_from(self._frame, offset)[0] # KIND_BYTES
+
+    def __reduce__(self):
+        return (translate_sbd_message, (self._frame, None, self._layout.projection))
+
+    def __getitem__(self, name):
+        try:
+            value = getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+        decoder = self._layout.accessors[name][0]
+        if decoder.kind == KIND_ARRAY:
+            return np.array(value, dtype=decoder.dtype)
+        return value
+
+    def __contains__(self, name):
+        return name in self._layout.accessors
+
+    def __iter__(self):
+        return iter(self._layout.accessors)
+
+    def __len__(self):
+        return len(self._layout.accessors)
+
+    def __repr__(self):
+        return 'TrackerMessage({})'.format(', '.join('{}={!r}'.format(name, getattr(self, name)) for name in self))
+
+    def keys(self):
+        """
+        Returns:
+            names, the names of the fields included in the message, in message order
+        """
+        return self._layout.accessors.keys()
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def as_dict(self):
+        """
+        Returns:
+            data, the message as dictionary, as returned by translate_sbd()
+        """
+        return dict(self.items())
+
+def translate_sbd_message(message, layout_cache=None, fields=None):
+    """
+    Parse binary SBD message from Sparkfun Artemis Global Tracker into a TrackerMessage.
+
+    Args:
+        message, binary message as byte array
+        layout_cache, LayoutCache to use (default: LAYOUT_CACHE)
+        fields, optional list of field names to decode; other fields are skipped without being unpacked
+
+    Returns:
+        msg, translated message as TrackerMessage
+    """
+    layout, _ = unpack_sbd(message, layout_cache, fields)
+    ind = 0 if message[0] == TrackerMessageFields.STX.value else 5
+    return TrackerMessage(layout, bytes(message[ind:ind + layout.unpacker.size]))
+
+"""
+Structured dtype of the DATETIME field.
+"""
+DATETIME_DTYPE = np.dtype([('YEAR', '<u2'), ('MONTH', 'u1'), ('DAY', 'u1'), ('HOUR', 'u1'), ('MIN', 'u1'), ('SEC', 'u1')])
+
+def layout_dtype(layout, header_len=0):
+    """
+    Build a NumPy structured dtype matching the frames of a layout, so that many frames
+    with the same layout can be viewed as one structured array.
+
+    Args:
+        layout, MessageLayout as returned by compile_layout()
+        header_len, number of bytes in front of STX (e.g. 5 for a gateway header)
+
+    Returns:
+        dtype, structured dtype with one entry per decoded field, named as in translate_sbd()
+    """
+    formats = []
+    offsets = []
+    for decoder, offset in layout.accessors.values():
+        if decoder.kind == KIND_SCALAR:
+            formats.append(decoder.dtype.newbyteorder('<'))
+        elif decoder.kind == KIND_ARRAY:
+            formats.append((decoder.dtype.newbyteorder('<'), (decoder.length // decoder.dtype.itemsize,)))
+        elif decoder.kind == KIND_DATETIME:
+            formats.append(DATETIME_DTYPE)
+        else: # KIND_BYTES
+            formats.append(('u1', (decoder.length,)))
+        offsets.append(header_len + offset)
+    return np.dtype({'names': list(layout.accessors), 'formats': formats, 'offsets': offsets,
+                     'itemsize': header_len + layout.unpacker.size})
+
+def datetime64_from_fields(dt):
+    """
+    Convert a DATETIME_DTYPE array into datetime64[s].
+
+    Args:
+        dt, array with DATETIME_DTYPE
+
+    Returns:
+        values, datetime64[s] array
+        valid, boolean array, False where the fields do not form a valid date and time
+    """
+    year = dt['YEAR'].astype(np.int64)
+    month = dt['MONTH'].astype(np.int64)
+    day = dt['DAY'].astype(np.int64)
+    valid = ((month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) &
+             (dt['HOUR'] < 24) & (dt['MIN'] < 60) & (dt['SEC'] < 60))
+    months = (year - 1970) * 12 + np.clip(month, 1, 12) - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+    valid &= (days.astype('datetime64[M]') == months.astype('datetime64[M]')) # e.g. 31st of April
+    values = (days.astype('datetime64[s]') + dt['HOUR'].astype('timedelta64[h]')
+              + dt['MIN'].astype('timedelta64[m]') + dt['SEC'].astype('timedelta64[s]'))
+    return values, valid
+
+def datetime64_to_fields(values):
+    """
+    Convert datetime64 values into a DATETIME_DTYPE array, the inverse of datetime64_from_fields().
+
+    Args:
+        values, datetime64 array (or anything NumPy converts to datetime64[s])
+
+    Returns:
+        dt, array with DATETIME_DTYPE
+    """
+    values = np.asarray(values, dtype='datetime64[s]')
+    if np.any(np.isnat(values)):
+        raise ValueError('DATETIME must not be NaT.')
+    years = values.astype('datetime64[Y]')
+    months = values.astype('datetime64[M]')
+    days = values.astype('datetime64[D]')
+    seconds = (values - days).astype(np.int64)
+    dt = np.zeros(values.shape, dtype=DATETIME_DTYPE)
+    dt['YEAR'] = years.astype(np.int64) + 1970
+    dt['MONTH'] = (months - years.astype('datetime64[M]')).astype(np.int64) + 1
+    dt['DAY'] = (days - months.astype('datetime64[D]')).astype(np.int64) + 1
+    dt['HOUR'] = seconds // 3600
+    dt['MIN'] = seconds // 60 % 60
+    dt['SEC'] = seconds % 60
+    return dt
+
+def translate_sbd_batch(messages, layout_cache=None, fields=None):
+    """
+    Parse many binary SBD messages into columns instead of one dictionary per message.
+
+    Messages are grouped by layout and gateway header. Each group is viewed as one
+    NumPy structured array, its checksums are verified with validate_checksums() and
+    CONVERSION_FACTOR is applied to whole columns.
+
+    Args:
+        messages, iterable of binary messages as byte arrays
+        layout_cache, LayoutCache to use (default: LAYOUT_CACHE)
+        fields, optional list of field names to decode; other fields are skipped without being unpacked
+
+    Returns:
+        columns, dictionary of masked arrays with one row per message, keyed by field name.
+            Rows are masked where a message does not include the field or is invalid.
+            DATETIME is datetime64[s], scaled fields are float64, MOFIELDS and other
+            array fields have one row of values per message. A DATETIME that is not a
+            valid date is masked, while the other fields of that message are kept.
+        valid, boolean array, False for messages that could not be translated
+    """
+    if layout_cache is None:
+        layout_cache = LAYOUT_CACHE
+    projection = field_projection(fields)
+    stx = TrackerMessageFields.STX.value
+    groups = {}
+    num = 0
+    for row, message in enumerate(messages):
+        num += 1
+        try:
+            ind = 0 if message[0] == stx else 5 # assuming gateway header
+            if message[ind] != stx:
+                continue
+            layout, _ = layout_cache.unpack(message, ind, projection)
+        except (ValueError, AssertionError, IndexError):
+            continue
+        group = groups.setdefault((layout.signature, ind), (layout, [], []))
+        group[1].append(row)
+        group[2].append(bytes(message[:ind + layout.unpacker.size]))
+    valid = np.zeros(num, dtype=bool)
+    raw = {} # name -> list of (rows, raw column)
+    for (_, ind), (layout, rows, frames) in groups.items():
+        dtype = layout_dtype(layout, header_len=ind)
+        buf = np.frombuffer(b''.join(frames), dtype=np.uint8)
+        rows = np.asarray(rows, dtype=np.int64)
+        ok = validate_checksums(buf, lengths=np.full(len(frames), dtype.itemsize - ind),
+                                offsets=np.arange(len(frames)) * dtype.itemsize + ind)
+        records = buf.view(dtype)[ok]
+        rows = rows[ok]
+        valid[rows] = True
+        for name in dtype.names:
+            raw.setdefault(name, []).append((rows, records[name]))
+    columns = {}
+    for name, parts in raw.items():
+        field = TrackerMessageFields[name]
+        scale = CONVERSION_FACTOR.get(field)
+        first = parts[0][1]
+        if field == TrackerMessageFields.DATETIME:
+            data = np.zeros(num, dtype='datetime64[s]')
+        else:
+            data = np.zeros((num,) + first.shape[1:], dtype=np.float64 if scale else first.dtype)
+        mask = np.ones(data.shape, dtype=bool)
+        for rows, values in parts:
+            if field == TrackerMessageFields.DATETIME:
+                values, ok = datetime64_from_fields(values)
+                mask[rows[ok]] = False
+                data[rows] = values
+                continue
+            data[rows] = values * scale if scale else values
+            mask[rows] = False
+        columns[name] = np.ma.MaskedArray(data, mask=mask)
+    return columns, valid
+
+"""
+Start of the RockBLOCK gateway header of binary messages, followed by the
+destination serial number as 3 bytes, big endian.
+"""
+RB_HEADER = b'RB'
+
+def gateway_header(serial):
+    """
+    Build the gateway header of a binary message forwarded by the RockBLOCK gateway.
+
+    Args:
+        serial, RockBLOCK serial number of the destination
+
+    Returns:
+        header, 5 bytes
+    """
+    serial = int(serial)
+    if not 0 <= serial < 1 << 24:
+        raise ValueError('RockBLOCK serial number {} does not fit into 3 bytes.'.format(serial))
+    return RB_HEADER + serial.to_bytes(3, 'big')
+
+def _encode_signature(names):
+    """
+    Map field names to the signature of the message containing them, in ascending ID order.
+    """
+    unknown = [name for name in names if name not in TrackerMessageFields.__members__]
+    if unknown:
+        raise ValueError('Unknown fields: {}'.format(', '.join(sorted(unknown))))
+    signature = sorted(TrackerMessageFields[name].value for name in names)
+    if TrackerMessageFields.STX.value in signature or TrackerMessageFields.ETX.value in signature:
+        raise ValueError('STX and ETX are added by the encoder and cannot be given as fields.')
+    return tuple(signature)
+
+def encode_sbd(data, header=None, layout_cache=None):
+    """
+    Build a binary SBD message, the inverse of translate_sbd().
+    Fields are written in ascending ID order, like the tracker does.
+
+    Args:
+        data, dictionary of field values keyed by field name, in the units of translate_sbd()
+            (scaled by CONVERSION_FACTOR, DATETIME as datetime.datetime, array fields as sequences).
+            Fields without data (e.g. USERFUNC1) are included if their name is present.
+        header, optional RockBLOCK serial number for a gateway header
+        layout_cache, LayoutCache to use (default: LAYOUT_CACHE)
+
+    Returns:
+        message, binary message as bytes
+    """
+    if layout_cache is None:
+        layout_cache = LAYOUT_CACHE
+    layout = layout_cache.get(_encode_signature(data))
+    values = [TrackerMessageFields.STX.value]
+    for field_id in layout.signature:
+        decoder = FIELD_DECODERS[field_id]
+        values.append(field_id)
+        if decoder.kind == KIND_EMPTY:
+            continue
+        value = data[decoder.name]
+        if decoder.kind == KIND_SCALAR:
+            if decoder.scale:
+                value = value / decoder.scale
+            values.append(float(value) if decoder.dtype.kind == 'f' else int(round(value)))
+        elif decoder.kind == KIND_DATETIME:
+            values.extend(value.timetuple()[:6])
+        elif decoder.kind == KIND_ARRAY:
+            values.extend(int(item) for item in value)
+        else: # KIND_BYTES
+            value = bytes(value)
+            if len(value) != decoder.length:
+                raise ValueError('{} must have {} bytes.'.format(decoder.name, decoder.length))
+            values.append(value)
+    values.extend((TrackerMessageFields.ETX.value, 0, 0))
+    try:
+        frame = bytearray(layout.unpacker.pack(*values))
+    except struct.error as err:
+        raise ValueError('Cannot encode message: {}'.format(err))
+    cs_a, cs_b = checksum(frame[:-2]) # STX to ETX
+    frame[-2] = cs_a
+    frame[-1] = cs_b
+    return (b'' if header is None else gateway_header(header)) + bytes(frame)
+
+def _encode_column(column, decoder):
+    """
+    Convert one column in the units of translate_sbd_batch() into the binary values of a field.
+    """
+    values = np.asarray(column)
+    if decoder.scale:
+        values = np.rint(values / decoder.scale)
+    if decoder.dtype.kind == 'f':
+        return values.astype(decoder.dtype)
+    if values.dtype.kind == 'f':
+        values = np.rint(values)
+    info = np.iinfo(decoder.dtype)
+    if np.any((values < info.min) | (values > info.max)):
+        raise ValueError('{} out of range for {}.'.format(decoder.name, decoder.dtype))
+    return values.astype(decoder.dtype)
+
+def encode_sbd_batch(columns, header=None, layout_cache=None):
+    """
+    Build many binary SBD messages with the same fields at once, the inverse of translate_sbd_batch().
+
+    All frames are written into one uint8 array through the structured dtype of their layout,
+    and the checksums are computed with checksum_batch(), so no Python code runs per message.
+
+    Args:
+        columns, dictionary of arrays with one row per message, keyed by field name, in the
+            units of translate_sbd_batch() (DATETIME as datetime64, array fields with one row
+            of values per message). Masked arrays must not have masked values. Fields without
+            data (e.g. USERFUNC1) are included if their name is present.
+        header, optional RockBLOCK serial number for a gateway header, or an array with
+            one serial number per message
+        layout_cache, LayoutCache to use (default: LAYOUT_CACHE)
+
+    Returns:
+        frames, 2D uint8 array with one message per row (use bytes(row) or frames.tobytes());
+            it can be passed to checksum_batch() and validate_checksums() directly
+    """
+    if layout_cache is None:
+        layout_cache = LAYOUT_CACHE
+    layout = layout_cache.get(_encode_signature(columns))
+    lengths = set(len(column) for column in columns.values())
+    if len(lengths) != 1:
+        raise ValueError('All columns must have the same number of rows.')
+    num = lengths.pop()
+    header_len = 0 if header is None else len(RB_HEADER) + 3
+    dtype = layout_dtype(layout, header_len=header_len)
+    template = bytearray(header_len)
+    template.append(TrackerMessageFields.STX.value)
+    for field_id in layout.signature:
+        template.append(field_id)
+        template += bytes(FIELD_DECODERS[field_id].length)
+    template += bytes([TrackerMessageFields.ETX.value, 0, 0])
+    frames = np.empty((num, dtype.itemsize), dtype=np.uint8)
+    frames[:] = np.frombuffer(bytes(template), dtype=np.uint8)
+    records = frames.reshape(-1).view(dtype)
+    for name, (decoder, _) in layout.accessors.items():
+        column = columns[name]
+        if np.ma.is_masked(column):
+            raise ValueError('{} has masked values.'.format(name))
+        column = np.ma.getdata(column)
+        if decoder.kind == KIND_DATETIME:
+            records[name] = datetime64_to_fields(column)
+        elif decoder.kind == KIND_BYTES:
+            column = np.frombuffer(b''.join(bytes(value) for value in column), dtype=np.uint8)
+            if column.size != num * decoder.length:
+                raise ValueError('{} must have {} bytes.'.format(name, decoder.length))
+            records[name] = column.reshape(num, decoder.length)
+        else:
+            records[name] = _encode_column(column, decoder)
+    if header is not None:
+        serial = np.broadcast_to(np.asarray(header, dtype=np.int64), (num,))
+        if np.any((serial < 0) | (serial >= 1 << 24)):
+            raise ValueError('RockBLOCK serial numbers must fit into 3 bytes.')
+        frames[:, :len(RB_HEADER)] = np.frombuffer(RB_HEADER, dtype=np.uint8)
+        frames[:, 2] = serial >> 16
+        frames[:, 3] = (serial >> 8) & 0xff
+        frames[:, 4] = serial & 0xff
+    cs_a, cs_b = checksum_batch(frames.reshape(-1), lengths=np.full(num, dtype.itemsize - header_len - 2),
+                                offsets=np.arange(num, dtype=np.int64) * dtype.itemsize + header_len)
+    frames[:, -2] = cs_a
+    frames[:, -1] = cs_b
+    return frames
+
+"""
+Fields of MO text messages that are not sent in the units of CONVERSION_FACTOR,
+with the factor from the binary value to the text value.
+"""
+TEXT_CONVERSION_FACTOR = {
+        TrackerMessageFields.SPEED: 1e-3 # binary in mm/s, text in m/s
+}
+
+"""
+Fields of MO text messages sent as ASCII-encoded Hex of their (little endian) binary bytes.
+"""
+TEXT_HEX_FIELDS = frozenset([TrackerMessageFields.GEOFSTAT, TrackerMessageFields.MOFIELDS,
+                             TrackerMessageFields.FLAGS1, TrackerMessageFields.FLAGS2])
+
+"""
+Fields of MO text messages sent as two nibbles in the format m.n
+"""
+TEXT_NIBBLE_FIELDS = frozenset([TrackerMessageFields.SWVER, TrackerMessageFields.GEOFNUM])
+
+"""
+Gateway header of MO text messages: "RB" plus seven digits, followed by a comma.
+"""
+TEXT_HEADER = re.compile(rb'^RB\d{7},')
+
+def mofields_field_ids(mofields):
+    """
+    List the fields selected by MOFIELDS, in the order they are sent in MO text messages.
+    The most significant bit of the first uint32 selects field 0x00, the least significant
+    bit of the third uint32 selects field 0x5f. Fields which are not valid for MO messages are ignored.
+
+    Args:
+        mofields, three uint32 values (e.g. the MOFIELDS field of a translated message) or
+            24 hex digits as sent in MO text messages (e.g. '000f00000000000000000000')
+
+    Returns:
+        fields, tuple of TrackerMessageFields in ascending ID order
+    """
+    if isinstance(mofields, (str, bytes)):
+        mofields = struct.unpack('<3I', bytes.fromhex(mofields.decode() if isinstance(mofields, bytes) else mofields))
+    if len(mofields) != 3:
+        raise ValueError('MOFIELDS must consist of three uint32 values.')
+    selected = []
+    for field in TrackerMessageFields:
+        decoder = FIELD_DECODERS[field.value]
+        if field.value >= 0x52 or decoder is None or decoder.kind == KIND_EMPTY: # RBHEAD and USERFUNCs are not sent in MO messages
+            continue
+        if (int(mofields[field.value // 32]) >> (31 - field.value % 32)) & 1:
+            selected.append(field)
+    return tuple(sorted(selected, key=operator.attrgetter('value')))
+
+def _text_column(field, tokens):
+    """
+    Convert the tokens of one field of many MO text messages into binary values.
+
+    Args:
+        field, TrackerMessageFields entry
+        tokens, NumPy bytes array with one token per message
+
+    Returns:
+        values, array in the units of translate_sbd_batch(), DATETIME_DTYPE for DATETIME
+        ok, boolean array, False where the value is out of range for the field
+    """
+    decoder = FIELD_DECODERS[field.value]
+    ok = np.ones(len(tokens), dtype=bool)
+    if field == TrackerMessageFields.DATETIME: # YYYYMMDDHHMMSS
+        if not np.all(np.char.str_len(tokens) == 14):
+            raise ValueError('DATETIME must have 14 digits.')
+        digits = np.frombuffer(tokens.astype('S14').tobytes(), dtype=np.uint8).reshape(-1, 14).astype(np.uint16) - ord('0')
+        if np.any(digits > 9):
+            raise ValueError('DATETIME must have 14 digits.')
+        values = np.zeros(len(tokens), dtype=DATETIME_DTYPE)
+        values['YEAR'] = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+        for i, name in enumerate(DATETIME_DTYPE.names[1:]):
+            values[name] = digits[:, 4 + 2 * i] * 10 + digits[:, 5 + 2 * i]
+        return values, ok
+    if field in TEXT_HEX_FIELDS:
+        if not np.all(np.char.str_len(tokens) == 2 * decoder.length):
+            raise ValueError('{} must have {} hex digits.'.format(field.name, 2 * decoder.length))
+        values = np.frombuffer(bytes.fromhex(b''.join(tokens).decode()), dtype=decoder.dtype.newbyteorder('<'))
+        return values.reshape(len(tokens), -1) if decoder.kind == KIND_ARRAY else values, ok
+    if field in TEXT_NIBBLE_FIELDS:
+        parts = np.char.partition(tokens, b'.')
+        high, low = parts[:, 0].astype(np.int64), parts[:, 2].astype(np.int64)
+        ok = (parts[:, 1] == b'.') & (high >= 0) & (high < 16) & (low >= 0) & (low < 16)
+        return ((high << 4) | (low & 0x0f)).astype(decoder.dtype), ok
+    if field in CONVERSION_FACTOR or decoder.dtype.kind == 'f':
+        values = tokens.astype(np.float64)
+        return values if field in CONVERSION_FACTOR else values.astype(decoder.dtype), ok
+    if field in TEXT_CONVERSION_FACTOR:
+        values = np.rint(tokens.astype(np.float64) / TEXT_CONVERSION_FACTOR[field])
+    else:
+        values = tokens.astype(np.int64)
+    info = np.iinfo(decoder.dtype)
+    ok = (values >= info.min) & (values <= info.max)
+    return np.where(ok, values, 0).astype(decoder.dtype), ok
+
+def _text_column_checked(field, tokens):
+    """
+    Like _text_column(), but a malformed token only invalidates its own message:
+    if a column cannot be converted as a whole, its halves are converted separately,
+    so a few bad tokens cost a few extra NumPy calls instead of one call per token.
+
+    Returns:
+        values, array as returned by _text_column(), or None if no token could be converted
+        ok, boolean array, False where the token is malformed or out of range
+    """
+    try:
+        return _text_column(field, tokens)
+    except ValueError:
+        if len(tokens) == 1:
+            return None, np.zeros(1, dtype=bool)
+    half = len(tokens) // 2
+    parts = [_text_column_checked(field, tokens[:half]), _text_column_checked(field, tokens[half:])]
+    ok = np.concatenate([part_ok for _, part_ok in parts])
+    converted = [values for values, _ in parts if values is not None]
+    if not converted:
+        return None, ok
+    values = np.zeros((len(tokens),) + converted[0].shape[1:], dtype=converted[0].dtype)
+    if parts[0][0] is not None:
+        values[:half] = parts[0][0]
+    if parts[1][0] is not None:
+        values[half:] = parts[1][0]
+    return values, ok
+
+def translate_text_batch(messages, mofields, fields=None):
+    """
+    Parse many MO text messages into the same columns as translate_sbd_batch().
+
+    Text messages are comma separated values in ascending ID order of the fields selected
+    by MOFIELDS, optionally preceded by a gateway header. All messages are split at once
+    and each field is converted as one NumPy column. Messages with the wrong number of
+    values or a malformed value are marked as invalid.
+
+    Args:
+        messages, iterable of text messages as bytes or str
+        mofields, MOFIELDS setting of the tracker, see mofields_field_ids()
+        fields, optional list of field names to decode; other fields are skipped without being converted
+
+    Returns:
+        columns, dictionary of masked arrays with one row per message, keyed by field name
+        valid, boolean array, False for messages that could not be translated
+    """
+    projection = field_projection(fields)
+    selected = mofields_field_ids(mofields)
+    if not selected:
+        raise ValueError('MOFIELDS does not select any MO fields.')
+    rows = []
+    lines = []
+    num = 0
+    for row, message in enumerate(messages):
+        num += 1
+        if isinstance(message, str):
+            message = message.encode('ascii', errors='replace')
+        line = bytes(message).strip()
+        if TEXT_HEADER.match(line):
+            line = line[10:]
+        if line.count(b',') == len(selected) - 1:
+            rows.append(row)
+            lines.append(line)
+    valid = np.zeros(num, dtype=bool)
+    rows = np.asarray(rows, dtype=np.int64)
+    converted = []
+    ok = np.ones(len(rows), dtype=bool)
+    if lines:
+        tokens = np.array(b','.join(lines).split(b','), dtype=bytes).reshape(len(lines), len(selected))
+    for col, field in enumerate(selected):
+        if not lines or (projection is not None and field.name not in projection):
+            continue
+        values, col_ok = _text_column_checked(field, tokens[:, col])
+        ok &= col_ok
+        if values is not None:
+            converted.append((field, values))
+    if len(rows):
+        valid[rows[ok]] = True
+    columns = {}
+    for field, values in converted:
+        if field == TrackerMessageFields.DATETIME:
+            values, dt_ok = datetime64_from_fields(values)
+            data = np.zeros(num, dtype='datetime64[s]')
+            mask = np.ones(num, dtype=bool)
+            data[rows] = values
+            mask[rows[ok & dt_ok]] = False
+        else:
+            data = np.zeros((num,) + values.shape[1:], dtype=values.dtype)
+            mask = np.ones(data.shape, dtype=bool)
+            data[rows[ok]] = values[ok]
+            mask[rows[ok]] = False
+        columns[field.name] = np.ma.MaskedArray(data, mask=mask)
+    return columns, valid
+
+def batch_messages(columns, valid):
+    """
+    Turn the columns of translate_sbd_batch() or translate_text_batch() back into one
+    dictionary per valid message, with the same value types as translate_sbd().
+
+    Args:
+        columns, dictionary of masked arrays as returned by the batch functions
+        valid, boolean array as returned by the batch functions
+
+    Returns:
+        messages, generator of (row, translated message as dictionary)
+    """
+    for row in np.flatnonzero(valid):
+        row = int(row)
+        msg = {}
+        for name, column in columns.items():
+            if np.all(column.mask[row]):
+                continue
+            value = column.data[row]
+            if name == 'DATETIME':
+                msg[name] = value.astype(datetime.datetime)
+            elif np.ndim(value):
+                msg[name] = np.array(value)
+            else:
+                msg[name] = value.item()
+        yield row, msg
+
+"""
+Quality flags set by quality_flags(), combined bitwise per message.
+"""
+QUALITY_RANGE      = 0x01 # a field is outside of QUALITY_RANGES
+QUALITY_ZERO_POS   = 0x02 # LAT and LON are both 0, as sent by the tracker without a fix
+QUALITY_NO_FIX     = 0x04 # FIX is no fix or time only, or SATS is 0
+QUALITY_HIGH_PDOP  = 0x08 # PDOP above the limit
+QUALITY_SPEED      = 0x10 # position out of reach of the neighbouring plausible positions of the tracker
+QUALITY_TIME       = 0x20 # DATETIME earlier than that of the previous message of the tracker
+
+QUALITY_FLAG_NAMES = OrderedDict([(QUALITY_RANGE, 'range'), (QUALITY_ZERO_POS, 'zero position'),
+                                  (QUALITY_NO_FIX, 'no fix'), (QUALITY_HIGH_PDOP, 'high PDOP'),
+                                  (QUALITY_SPEED, 'impossible speed'), (QUALITY_TIME, 'time regression')])
+
+"""
+Plausible ranges of decoded fields, in the units of translate_sbd() (SPEED in mm/s).
+Limits of the u-blox receiver (airborne dynamic model) and the MS8607 sensor.
+"""
+QUALITY_RANGES = {
+        'LAT': (-90.0, 90.0),
+        'LON': (-180.0, 180.0),
+        'ALT': (-1000.0, 50000.0),
+        'SPEED': (0, 500000),
+        'HEAD': (0.0, 360.0),
+        'PDOP': (0.0, 99.99),
+        'FIX': (0, 5),
+        'PRESS': (10, 2000),
+        'TEMP': (-40.0, 85.0),
+        'HUMID': (0.0, 100.0)
+}
+
+"""
+Default limits of quality_flags(): PDOP and speed over ground in m/s.
+"""
+QUALITY_MAX_PDOP = 10.0
+QUALITY_MAX_SPEED = 500.0
+
+"""
+Fields used by quality_flags().
+"""
+QUALITY_FIELDS = tuple(QUALITY_RANGES) + ('SATS', 'DATETIME', 'SOURCE')
+
+EARTH_RADIUS = 6371008.8 # mean radius in m
+
+def _column(columns, name, num):
+    """
+    Get the data and presence of a column, or an empty column if it is missing.
+    """
+    if name not in columns:
+        return np.zeros(num), np.zeros(num, dtype=bool)
+    column = columns[name]
+    return np.ma.getdata(column), ~np.ma.getmaskarray(column)
+
+def _previous_in_track(order, present, tracker):
+    """
+    Pair each message with the previous one of the same tracker among the present ones.
+
+    Returns:
+        previous, rows of the earlier messages
+        current, rows of the later messages
+    """
+    rows = order[present[order]]
+    same = tracker[rows[1:]] == tracker[rows[:-1]]
+    return rows[:-1][same], rows[1:][same]
+
+def _impossible_moves(order, present, tracker, lat, lon, seconds, max_speed):
+    """
+    Find the moves between consecutive positions of a tracker that are faster than max_speed (in m/s).
+
+    Returns:
+        has_in, boolean array, True where a message has a previous position
+        has_out, boolean array, True where a message has a next position
+        bad_in, boolean array, True where the move from the previous position is impossible
+        bad_out, boolean array, True where the move to the next position is impossible
+    """
+    previous, current = _previous_in_track(order, present, tracker)
+    lat0, lat1 = np.radians(lat[previous]), np.radians(lat[current])
+    a = (np.sin((lat1 - lat0) / 2) ** 2 +
+         np.cos(lat0) * np.cos(lat1) * np.sin(np.radians(lon[current] - lon[previous]) / 2) ** 2)
+    distance = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    elapsed = np.maximum(seconds[current] - seconds[previous], 1) # DATETIME has a resolution of 1 s
+    impossible = distance > max_speed * elapsed
+    has_in, has_out, bad_in, bad_out = (np.zeros(len(present), dtype=bool) for _ in range(4))
+    has_in[current] = True
+    has_out[previous] = True
+    bad_in[current] = impossible
+    bad_out[previous] = impossible
+    return has_in, has_out, bad_in, bad_out
+
+def quality_flags(columns, valid=None, momsn=None, tracker=None, max_pdop=QUALITY_MAX_PDOP, max_speed=QUALITY_MAX_SPEED):
+    """
+    Assess the quality of decoded messages, with whole-column NumPy operations instead of per-message checks.
+
+    Speed and time checks compare each message with the previous one of the same tracker,
+    in MOMSN order if given, otherwise in row order. The speed check only uses positions
+    without other flags and flags a position that can neither be reached from the previous
+    one nor left towards the next one, so a single bad fix does not flag its neighbours.
+    A jump between two consistent parts of a track is not flagged, as it cannot be told
+    which part is wrong.
+
+    Args:
+        columns, dictionary of (masked) arrays as returned by translate_sbd_batch(), translate_text_batch() or message_columns()
+        valid, optional boolean array, False for messages that could not be translated (these get no flags)
+        momsn, optional array of MOMSNs
+        tracker, optional array identifying the tracker of each message (default: SOURCE if included, otherwise one tracker)
+        max_pdop, PDOP above which QUALITY_HIGH_PDOP is set
+        max_speed, speed in m/s between consecutive positions above which QUALITY_SPEED is set
+
+    Returns:
+        flags, uint8 array of QUALITY_* flags per message, 0 where no problem was found
+    """
+    if valid is None:
+        valid = np.ones(len(next(iter(columns.values()))) if columns else 0, dtype=bool)
+    valid = np.asarray(valid, dtype=bool)
+    num = len(valid)
+    flags = np.zeros(num, dtype=np.uint8)
+    for name, (low, high) in QUALITY_RANGES.items():
+        data, present = _column(columns, name, num)
+        flags[present & valid & ((data < low) | (data > high))] |= QUALITY_RANGE
+    lat, has_lat = _column(columns, 'LAT', num)
+    lon, has_lon = _column(columns, 'LON', num)
+    has_pos = has_lat & has_lon & valid
+    flags[has_pos & (lat == 0) & (lon == 0)] |= QUALITY_ZERO_POS
+    fix, has_fix = _column(columns, 'FIX', num)
+    sats, has_sats = _column(columns, 'SATS', num)
+    flags[valid & ((has_fix & ((fix == 0) | (fix == 5))) | (has_sats & (sats == 0)))] |= QUALITY_NO_FIX
+    pdop, has_pdop = _column(columns, 'PDOP', num)
+    flags[valid & has_pdop & (pdop > max_pdop)] |= QUALITY_HIGH_PDOP
+    if tracker is None:
+        source, has_source = _column(columns, 'SOURCE', num)
+        tracker = np.where(has_source, source, 0)
+    tracker = np.asarray(tracker)
+    order = np.lexsort((np.arange(num) if momsn is None else np.asarray(momsn), tracker))
+    times, has_time = _column(columns, 'DATETIME', num)
+    has_time &= valid
+    seconds = times.astype('datetime64[s]').astype(np.int64)
+    previous, current = _previous_in_track(order, has_time, tracker)
+    flags[current[seconds[current] < seconds[previous]]] |= QUALITY_TIME
+    plausible = has_pos & has_time & (flags == 0)
+    has_in, has_out, bad_in, bad_out = _impossible_moves(order, plausible, tracker, lat, lon, seconds, max_speed)
+    spikes = bad_in & bad_out
+    # with the spikes removed, the first and last positions of a track can only be checked against one neighbour
+    has_in, has_out, bad_in, bad_out = _impossible_moves(order, plausible & ~spikes, tracker, lat, lon, seconds, max_speed)
+    flags[spikes | (bad_in & ~has_out) | (bad_out & ~has_in)] |= QUALITY_SPEED
+    return flags
+
+def message_columns(messages, names=QUALITY_FIELDS):
+    """
+    Turn translated messages (dictionaries) into columns, e.g. for quality_flags().
+
+    Args:
+        messages, list of translated messages as dictionaries
+        names, field names to include
+
+    Returns:
+        columns, dictionary of masked arrays keyed by field name, masked where a message does not include the field
+    """
+    num = len(messages)
+    columns = {}
+    for name in names:
+        rows = [row for row, msg in enumerate(messages) if name in msg]
+        if not rows:
+            continue
+        if name == 'DATETIME':
+            values = np.array([messages[row][name] for row in rows], dtype='datetime64[s]')
+        else:
+            values = np.asarray([messages[row][name] for row in rows])
+        data = np.zeros((num,) + values.shape[1:], dtype=values.dtype)
+        mask = np.ones(data.shape, dtype=bool)
+        data[rows] = values
+        mask[rows] = False
+        columns[name] = np.ma.MaskedArray(data, mask=mask)
+    return columns
+
+def quality_summary(flags):
+    """
+    Count the messages with each quality flag.
+
+    Args:
+        flags, array as returned by quality_flags()
+
+    Returns:
+        counts, OrderedDict of flag name and number of messages with the flag set
+    """
+    return OrderedDict((name, int(np.count_nonzero(flags & flag))) for flag, name in QUALITY_FLAG_NAMES.items())
+
+"""
+Length prefix of the records in an SBD archive: little endian uint16, followed by the raw message.
+"""
+ARCHIVE_LENGTH_FORMAT = '<H'
+
+def archive_records(buf, length_format=ARCHIVE_LENGTH_FORMAT):
+    """
+    Walk the length-prefixed records of an SBD archive.
+
+    Args:
+        buf, archive contents, any object supporting the buffer protocol
+        length_format, struct format of the length prefix
+
+    Yields:
+        offset, start of the record data in buf
+        length, length of the record data
+    """
+    prefix = struct.Struct(length_format)
+    end = len(buf)
+    pos = 0
+    while pos + prefix.size <= end:
+        (length,) = prefix.unpack_from(buf, pos)
+        pos += prefix.size
+        if pos + length > end:
+            raise IndexError('Truncated archive record at offset {}.'.format(pos - prefix.size))
+        yield pos, length
+        pos += length
+    if pos != end:
+        raise IndexError('Truncated archive record at offset {}.'.format(pos))
+
+def read_archive(filename, length_format=ARCHIVE_LENGTH_FORMAT, layout_cache=None, fields=None, status=None):
+    """
+    Lazily translate all messages of an SBD archive file.
+
+    The file is memory-mapped and every record is handed to translate_sbd() as a
+    memoryview slice, so neither the file nor the records are copied into bytes and
+    archives of any size are scanned in constant memory.
+
+    Args:
+        filename, archive file name
+        length_format, struct format of the length prefix
+        layout_cache, LayoutCache to use (default: LAYOUT_CACHE)
+        fields, optional list of field names to decode; other fields are skipped without being unpacked
+        status, file for error messages (default: stdout)
+
+    Yields:
+        offset, start of the record data in the file
+        data, translated message as dictionary
+    """
+    with open(filename, 'rb') as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mm) as view:
+                try:
+                    for offset, length in archive_records(view, length_format):
+                        with view[offset:offset+length] as record:
+                            try:
+                                data = translate_sbd(record, layout_cache, fields)
+                            except (ValueError, AssertionError, IndexError) as err:
+                                print('Error translating message {} at offset {}: {}'.format(filename, offset, err), file=status)
+                                continue
+                        yield offset, data
+                except IndexError as err:
+                    print('Error reading archive {}: {}'.format(filename, err), file=status)
+
+def write_archive(filename, messages, length_format=ARCHIVE_LENGTH_FORMAT, append=False):
+    """
+    Write raw messages into an SBD archive file.
+
+    Args:
+        filename, archive file name
+        messages, iterable of binary messages as byte arrays
+        length_format, struct format of the length prefix
+        append, whether to append to an existing archive (default: False)
+
+    Returns:
+        count, number of messages written
+    """
+    prefix = struct.Struct(length_format)
+    count = 0
+    with open(filename, 'ab' if append else 'wb') as fd:
+        for message in messages:
+            fd.write(prefix.pack(len(message)))
+            fd.write(message)
+            count += 1
+    return count
+
+"""
+Maximum length of a frame from STX to the checksum bytes, i.e. the SBD MO message size limit.
+"""
+MAX_FRAME_LEN = 340
+
+class StreamDecoder:
+    """
+    Incremental decoder for binary messages embedded in a byte stream.
+
+    Data is fed chunk by chunk. The decoder searches for STX, walks the fields of each
+    candidate frame and confirms it with the Fletcher checksum. Bytes which do not belong
+    to a valid frame are skipped up to the next STX. A frame running past the end of the
+    data fed so far is kept until more data arrives or flush() is called.
+    """
+
+    def __init__(self, layout_cache=None, max_frame_len=MAX_FRAME_LEN, fields=None):
+        self.layout_cache = layout_cache
+        self.fields = field_projection(fields)
+        self.max_frame_len = max_frame_len
+        self.messages = 0 # number of decoded messages
+        self.resyncs = 0 # number of times bytes had to be skipped to find the next frame
+        self.skipped_bytes = 0 # number of skipped bytes, gateway headers not included
+        self._skipping = False
+        self._buffer = bytearray()
+
+    def stats(self):
+        """
+        Returns:
+            stats, dictionary with messages, resyncs, skipped_bytes and pending (buffered) bytes
+        """
+        return {'messages': self.messages, 'resyncs': self.resyncs,
+                'skipped_bytes': self.skipped_bytes, 'pending': len(self._buffer)}
+
+    def feed(self, chunk):
+        """
+        Add data to the stream.
+
+        Args:
+            chunk, byte array with the next part of the stream
+
+        Returns:
+            messages, list of translated messages completed by this chunk
+        """
+        self._buffer += chunk
+        return self._scan(final=False)
+
+    def flush(self):
+        """
+        Decode what is left at the end of the stream. Incomplete frames are skipped.
+
+        Returns:
+            messages, list of translated messages
+        """
+        return self._scan(final=True)
+
+    def _skip(self, start, end, before_frame):
+        """
+        Account for the bytes from start to end which do not belong to a frame.
+        A run of skipped bytes counts as one resync, even if it spans several chunks.
+        """
+        skipped = end - start
+        if before_frame and skipped >= 5 and self._buffer[end-5:end-3] == b'RB': # gateway header
+            skipped -= 5
+        if skipped > 0:
+            self.skipped_bytes += skipped
+            if not self._skipping:
+                self.resyncs += 1
+            self._skipping = True
+        if before_frame:
+            self._skipping = False
+
+    def _frame_length(self, start):
+        """
+        Walk the fields of the candidate frame at start.
+
+        Returns:
+            length, frame length, 0 if the frame is not complete yet, or -1 if the
+            candidate is not a valid frame
+        """
+        try:
+            signature = walk_signature(self._buffer, start)
+        except ValueError:
+            return -1
+        except IndexError:
+            return -1 if len(self._buffer) - start >= self.max_frame_len else 0
+        length = 4 + sum(1 + FIELD_DECODERS[field_id].length for field_id in signature)
+        if length > self.max_frame_len:
+            return -1
+        return length if start + length <= len(self._buffer) else 0
+
+    def _scan(self, final):
+        messages = []
+        buf = self._buffer
+        stx = bytes([TrackerMessageFields.STX.value])
+        pos = 0
+        done = 0 # bytes before done are decoded or accounted for as skipped
+        while True:
+            start = buf.find(stx, pos)
+            if start < 0:
+                end = len(buf) if final else max(done, len(buf) - 5) # keep a possible gateway header
+                self._skip(done, end, before_frame=False)
+                done = end
+                break
+            length = self._frame_length(start)
+            if length == 0 and not final: # wait for more data
+                end = max(done, start - 5)
+                self._skip(done, end, before_frame=False)
+                done = end
+                break
+            if length > 0:
+                try:
+                    data = translate_sbd(bytes(buf[start:start+length]), self.layout_cache, self.fields)
+                except (ValueError, AssertionError, IndexError):
+                    data = None
+                if data is not None:
+                    self._skip(done, start, before_frame=True)
+                    messages.append(data)
+                    self.messages += 1
+                    pos = done = start + length
+                    continue
+            pos = start + 1 # not a valid frame, try the next STX
+        del buf[:done]
+        return messages
+
+def decode_stream(chunks, decoder=None):
+    """
+    Translate all messages found in a stream of byte chunks, e.g. a serial capture
+    or a damaged archive.
+
+    Args:
+        chunks, iterable of byte arrays
+        decoder, StreamDecoder to use, e.g. to read its counters afterwards (default: new StreamDecoder)
+
+    Yields:
+        data, translated message as dictionary
+    """
+    if decoder is None:
+        decoder = StreamDecoder()
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    yield from decoder.flush()
+
+def read_chunks(filename, chunk_size=65536):
+    """
+    Read a file in chunks.
+
+    Args:
+        filename, file name
+        chunk_size, bytes per chunk
+
+    Yields:
+        chunk, bytes
+    """
+    with open(filename, 'rb') as fd:
+        while True:
+            chunk = fd.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def message2trackpoint(msg):
+    """
+    Creates a GPX trackpoint from a translated IRIDIUM message.
+
+    Args:
+        msg, translated SBD message
+
+    Returns:
+        pkt, GPX trackpoint corresponding to message data
+    """
+    return gpxpy.gpx.GPXTrackPoint(
+                msg['LAT'], msg['LON'], elevation=msg['ALT'], time=msg['DATETIME'],
+                comment='{} hPa'.format(msg['PRESS']) if 'PRESS' in msg else None)
+
+"""
+Number of messages requested with one IMAP FETCH command.
+"""
+IMAP_FETCH_BATCH = 500
+
+def message_set(nums):
+    """
+    Build an IMAP message set, collapsing consecutive numbers into ranges (e.g. 1:3,7).
+
+    Args:
+        nums, message numbers or UIDs as int, str or bytes
+
+    Returns:
+        message_set, string for imaplib's fetch() and store()
+    """
+    nums = sorted(int(num) for num in nums)
+    ranges = []
+    for num in nums:
+        if ranges and num == ranges[-1][1] + 1:
+            ranges[-1][1] = num
+        else:
+            ranges.append([num, num])
+    return ','.join(str(first) if first == last else '{}:{}'.format(first, last) for first, last in ranges)
+
+def fetch_responses(data):
+    """
+    Split the response of an IMAP FETCH command into its literals.
+
+    Args:
+        data, response data as returned by imaplib's fetch()
+
+    Returns:
+        responses, generator of (message number, response text in front of the literal, literal)
+    """
+    for item in data:
+        if isinstance(item, tuple): # (b'12 (RFC822 {2345}', literal), followed by b')'
+            yield int(item[0].split(None, 1)[0]), item[0], item[1]
+
+def _imap_command(imap, uid, command, *args):
+    """
+    Run FETCH, STORE or SEARCH with message numbers or, if uid is set, with UIDs.
+    """
+    if uid:
+        typ, data = imap.uid(command, *args)
+    else:
+        typ, data = getattr(imap, command.lower())(*args)
+    if typ != 'OK':
+        raise imaplib.IMAP4.error('{} failed: {}'.format(command, data))
+    return data
+
+def fetch_batches(imap, nums, parts='(RFC822)', batch_size=IMAP_FETCH_BATCH, uid=False):
+    """
+    Fetch many messages with one FETCH command per batch instead of one per message.
+
+    Args:
+        imap, imaplib object with open connection and selected mailbox
+        nums, message numbers, e.g. as returned by imap.search()
+        parts, message data items to fetch
+        batch_size, number of messages per FETCH command
+        uid, nums are UIDs (UID FETCH)
+
+    Returns:
+        batches, generator of lists of (message number, response text, literal), one list per FETCH command
+    """
+    nums = list(nums)
+    for ind in range(0, len(nums), batch_size):
+        yield list(fetch_responses(_imap_command(imap, uid, 'FETCH', message_set(nums[ind:ind + batch_size]), parts)))
+
+"""
+Tokens of IMAP responses: parentheses, quoted strings, literal announcements ({size} at the end of a line) and atoms.
+"""
+IMAP_TOKEN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|([^\s()"]+))')
+
+def _imap_tokens(data):
+    """
+    Tokenize response data as returned by imaplib, where lines ending in a literal come as (line, literal) tuples.
+
+    Returns:
+        tokens, generator of '(', ')', atoms and strings as bytes, NIL as None
+    """
+    for item in data:
+        line, literal = item if isinstance(item, tuple) else (item, None)
+        pos = 0
+        while True:
+            match = IMAP_TOKEN.match(line, pos)
+            if match is None:
+                break
+            pos = match.end()
+            if match.group(1):
+                yield '('
+            elif match.group(2):
+                yield ')'
+            elif match.group(3) is not None:
+                yield re.sub(rb'\\(.)', rb'\1', match.group(3))
+            elif match.group(4) is not None:
+                yield literal
+            else:
+                yield None if match.group(5).upper() == b'NIL' else match.group(5)
+
+def fetch_items(data):
+    """
+    Parse the response of an IMAP FETCH command, including nested lists like BODYSTRUCTURE.
+
+    Args:
+        data, response data as returned by imaplib's fetch()
+
+    Returns:
+        items, generator of (message number, dictionary of data items keyed by upper case name, e.g. 'BODY[2]')
+    """
+    tokens = _imap_tokens(data)
+    def parse_list():
+        values = []
+        for token in tokens:
+            if token == '(':
+                values.append(parse_list())
+            elif token == ')':
+                return values
+            else:
+                values.append(token)
+        return values
+    for token in tokens:
+        if token in ('(', ')') or token is None or not token.isdigit():
+            continue
+        num = int(token)
+        if next(tokens, None) != '(':
+            continue
+        values = parse_list()
+        yield num, {name.decode().upper(): value for name, value in zip(values[0::2], values[1::2])}
+
+def attachment_parts(bodystructure, prefix='', status=None):
+    """
+    Find the SBD attachments (.sbd or .bin files) in the BODYSTRUCTURE of an email.
+
+    Args:
+        bodystructure, parsed BODYSTRUCTURE as returned by fetch_items()
+        prefix, part number of bodystructure within the email (for the recursion)
+        status, file for warnings about other attachments (default: stdout)
+
+    Returns:
+        parts, list of (part number as used in BODY[...], file name, content transfer encoding)
+    """
+    if not isinstance(bodystructure, list) or not bodystructure:
+        return []
+    if isinstance(bodystructure[0], list): # multipart: body parts followed by the subtype
+        parts = []
+        for ind, part in enumerate(bodystructure):
+            if not isinstance(part, list):
+                break
+            parts.extend(attachment_parts(part, '{}{}.'.format(prefix, ind + 1), status))
+        return parts
+    names = {}
+    params = bodystructure[2] if len(bodystructure) > 2 and isinstance(bodystructure[2], list) else []
+    names.update(zip(params[0::2], params[1::2]))
+    for extension in bodystructure[7:]: # disposition, e.g. ("attachment" ("filename" "x.sbd"))
+        if isinstance(extension, list) and len(extension) == 2 and isinstance(extension[1], list):
+            names.update(zip(extension[1][0::2], extension[1][1::2]))
+    names = {key.lower(): value for key, value in names.items() if isinstance(key, bytes) and value}
+    filename = names.get(b'filename', names.get(b'name'))
+    if not filename:
+        return []
+    filename = filename.decode(errors='replace')
+    _, fileext = os.path.splitext(filename)
+    if fileext not in ['.sbd', '.bin']:
+        print('query_mail: unrecognized file extension {} of attachment.'.format(fileext), file=status)
+        return []
+    encoding = bodystructure[5].decode().lower() if len(bodystructure) > 5 and bodystructure[5] else '7bit'
+    return [((prefix or '1.')[:-1], filename, encoding)]
+
+def decode_part(body, encoding):
+    """
+    Undo the content transfer encoding of a body part fetched with BODY[...].
+    """
+    if encoding == 'base64':
+        return base64.b64decode(body)
+    if encoding == 'quoted-printable':
+        return quopri.decodestring(body)
+    return body
+
+def fetch_attachments(imap, nums, batch_size=IMAP_FETCH_BATCH, mark_seen=True, uid=False, status=None):
+    """
+    Fetch only the SBD attachments of mails instead of the whole mails: first the BODYSTRUCTURE
+    of a batch of mails, then BODY.PEEK[n] of their attachment parts, one FETCH command per part number.
+
+    BODY.PEEK leaves the \\Seen flags unchanged. With mark_seen, the mails of a batch are marked as seen
+    only once all their attachments have been yielded and the caller asks for the next one, so mails
+    are not lost if processing fails.
+
+    Args:
+        imap, imaplib object with open connection and selected mailbox
+        nums, message numbers, e.g. as returned by imap.search()
+        batch_size, number of mails per FETCH command
+        mark_seen, set the \\Seen flag of the mails after processing
+        uid, nums are UIDs (UID FETCH)
+        status, file for warnings about other attachments (default: stdout)
+
+    Returns:
+        attachments, generator of (message number or UID, attachment contents)
+    """
+    nums = list(nums)
+    for ind in range(0, len(nums), batch_size):
+        batch_set = message_set(nums[ind:ind + batch_size])
+        parts = {} # part number -> {message number or UID: encoding}
+        for num, items in fetch_items(_imap_command(imap, uid, 'FETCH', batch_set, '(UID BODYSTRUCTURE)' if uid else '(BODYSTRUCTURE)')):
+            key = int(items['UID']) if uid else num
+            for part, _, encoding in attachment_parts(items.get('BODYSTRUCTURE'), status=status):
+                parts.setdefault(part, {})[key] = encoding
+        attachments = []
+        for part, encodings in parts.items():
+            data = _imap_command(imap, uid, 'FETCH', message_set(encodings), '(BODY.PEEK[{}])'.format(part))
+            for num, items in fetch_items(data):
+                key = int(items['UID']) if uid else num
+                body = items.get('BODY[{}]'.format(part))
+                if body is not None and key in encodings:
+                    attachments.append((key, decode_part(body, encodings[key])))
+        attachments.sort(key=operator.itemgetter(0))
+        yield from attachments
+        if mark_seen:
+            _imap_command(imap, uid, 'STORE', batch_set, '+FLAGS', '(\\Seen)')
+
+def query_mail(imap, from_address='@rockblock.rock7.com', unseen_only=True, batch_size=IMAP_FETCH_BATCH, attachments_only=False,
+               mailbox='Inbox', status=None):
+    """
+    Query IMAP server for new mails from IRIDIUM gateway and extract new messages.
+
+    Args:
+        imap, imaplib object with open connection
+        from_address, sender address to filter for
+        unseen_only, whether to only retrieve unseen messages (default: True)
+        batch_size, number of mails fetched with one FETCH command
+        attachments_only, fetch only the attachments instead of whole mails, see fetch_attachments()
+        mailbox, mailbox to search
+        status, file for warnings about other attachments (default: stdout)
+
+    Returns:
+        sbd_list, generator of sbd attachments, yielding those of each batch as soon as it arrived
+    """
+    imap.select(mailbox)
+    criteria = ['FROM', from_address]
+    if unseen_only:
+        criteria.append('(UNSEEN)')
+    retcode, messages = imap.search(None, *criteria)
+    if attachments_only:
+        for _, attachment in fetch_attachments(imap, messages[0].split(), batch_size, status=status):
+            yield attachment
+        return
+    for batch in fetch_batches(imap, messages[0].split(), '(RFC822)', batch_size):
+        for _, _, raw_message in batch:
+            yield from sbd_attachments(email.message_from_bytes(raw_message), status)
+
+def sbd_attachments(message, status=None):
+    """
+    Extract the SBD attachments (.sbd or .bin files) of an email from the IRIDIUM gateway.
+
+    Args:
+        message, email.message.Message
+        status, file for warnings about other attachments (default: stdout)
+
+    Returns:
+        sbd_list, list of attachment contents
+    """
+    return [content for _, content in sbd_attachment_files(message, status)]
+
+def sbd_attachment_files(message, status=None):
+    """
+    Extract the SBD attachments (.sbd or .bin files) of an email from the IRIDIUM gateway, with their file names.
+
+    Args:
+        message, email.message.Message
+        status, file for warnings about other attachments (default: stdout)
+
+    Returns:
+        sbd_list, list of (file name, attachment content)
+    """
+    sbd_list = []
+    for part in message.walk():
+        if part.get_content_maintype() == 'multipart':
+            continue
+        if part.get('Content-Disposition') is None:
+            continue
+        filename = part.get_filename()
+        if bool(filename):
+            _, fileext = os.path.splitext(filename)
+            if fileext in ['.sbd', '.bin']:
+                sbd_list.append((filename, part.get_payload(decode=True)))
+            else:
+                print('query_mail: unrecognized file extension {} of attachment.'.format(fileext), file=status)
+    return sbd_list
+
+class MailSyncState:
+    """
+    On-disk SQLite state of the incremental IMAP sync: UIDVALIDITY, the highest processed UID
+    and, for servers with CONDSTORE, HIGHESTMODSEQ of each mailbox. Every update is committed
+    right away, so a restart continues where the last run stopped.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._db = sqlite3.connect(filename)
+        self._db.execute('CREATE TABLE IF NOT EXISTS mailboxes (key TEXT PRIMARY KEY, uidvalidity INTEGER, '
+                         'last_uid INTEGER, modseq INTEGER, updated REAL)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Close the database.
+        """
+        self._db.close()
+
+    def lookup(self, key):
+        """
+        Look up the state of a mailbox.
+
+        Args:
+            key, mailbox key, see sync_key()
+
+        Returns:
+            uidvalidity, UIDVALIDITY of the last sync, or None if the mailbox was never synced
+            last_uid, highest processed UID (0 if none)
+            modseq, HIGHESTMODSEQ of the last sync, or None
+        """
+        row = self._db.execute('SELECT uidvalidity, last_uid, modseq FROM mailboxes WHERE key = ?', (key,)).fetchone()
+        return tuple(row) if row is not None else (None, 0, None)
+
+    def store(self, key, uidvalidity, last_uid, modseq=None):
+        """
+        Store the state of a mailbox and commit it.
+        """
+        self._db.execute('INSERT OR REPLACE INTO mailboxes VALUES (?, ?, ?, ?, ?)', (key, uidvalidity, last_uid, modseq, time.time()))
+        self._db.commit()
+
+def sync_key(user, host, mailbox, from_address):
+    """
+    Key of a mailbox in MailSyncState. The sender filter is included, as it changes which UIDs are processed.
+    """
+    return '{}@{}/{}?from={}'.format(user, host, mailbox, from_address)
+
+def _select_status(imap, mailbox):
+    """
+    Select a mailbox read-only, enabling CONDSTORE if the server supports it.
+
+    Returns:
+        uidvalidity, UIDVALIDITY of the mailbox
+        uidnext, predicted next UID, or None if the server did not send it
+        modseq, HIGHESTMODSEQ, or None without CONDSTORE
+    """
+    if 'CONDSTORE' in imap.capabilities and 'ENABLE' in imap.capabilities and imap.state == 'AUTH':
+        imap.enable('CONDSTORE')
+    typ, data = imap.select(mailbox, readonly=True)
+    if typ != 'OK':
+        raise imaplib.IMAP4.error('SELECT failed: {}'.format(data))
+    def code(name):
+        _, values = imap.response(name)
+        value = values[-1] if values and values[-1] is not None else None
+        return int(value.split()[0]) if value else None
+    return code('UIDVALIDITY'), code('UIDNEXT'), code('HIGHESTMODSEQ')
+
+def sync_mail(imap, state, key, mailbox='Inbox', from_address='@rockblock.rock7.com', batch_size=IMAP_FETCH_BATCH,
+              attachments_only=False, full=False, status=None, checkpoint=None):
+    """
+    Fetch the SBD attachments of the mails that arrived since the last sync, by UID instead of the \\Seen flag,
+    so other clients reading the mailbox do not interfere. Flags are left unchanged.
+
+    Only UIDs above the stored high-water mark are searched. If the server reports an unchanged
+    HIGHESTMODSEQ (CONDSTORE) or no new UID (UIDNEXT), not even a SEARCH is needed. If UIDVALIDITY
+    changed, the mailbox is synced from the start. The state is stored after each batch once all its
+    attachments have been taken and checkpoint() returned, so after a crash at most one batch is fetched again.
+
+    Args:
+        imap, imaplib object with open connection
+        state, MailSyncState
+        key, mailbox key, see sync_key()
+        mailbox, mailbox to sync
+        from_address, sender address to filter for
+        batch_size, number of mails fetched with one FETCH command
+        attachments_only, fetch only the attachments instead of whole mails, see fetch_attachments()
+        full, sync from the start, ignoring the stored high-water mark
+        status, file for warnings about other attachments (default: stdout)
+        checkpoint, optional function called before the state of a batch is stored, e.g. to wait until
+                    its attachments have been processed elsewhere; if it raises, the state is not stored
+
+    Returns:
+        sbd_list, generator of sbd attachments
+    """
+    uidvalidity, uidnext, modseq = _select_status(imap, mailbox)
+    stored_validity, last_uid, stored_modseq = state.lookup(key)
+    if full or stored_validity != uidvalidity:
+        last_uid, stored_modseq = 0, None
+    elif (modseq is not None and modseq == stored_modseq) or (uidnext is not None and uidnext <= last_uid + 1):
+        return
+    data = _imap_command(imap, True, 'SEARCH', None, 'UID', '{}:*'.format(last_uid + 1), 'FROM', from_address)
+    uids = sorted(uid for uid in map(int, data[0].split()) if uid > last_uid) # n:* always includes the last mail
+    for ind in range(0, len(uids), batch_size):
+        batch = uids[ind:ind + batch_size]
+        if attachments_only:
+            for _, attachment in fetch_attachments(imap, batch, batch_size, mark_seen=False, uid=True, status=status):
+                yield attachment
+        else:
+            for responses in fetch_batches(imap, batch, '(BODY.PEEK[])', batch_size, uid=True):
+                for _, _, raw_message in responses:
+                    yield from sbd_attachments(email.message_from_bytes(raw_message), status)
+        if checkpoint is not None:
+            checkpoint()
+        state.store(key, uidvalidity, batch[-1], modseq if ind + batch_size >= len(uids) else None)
+    if not uids:
+        state.store(key, uidvalidity, last_uid, modseq)
+
+"""
+Longest wait in IDLE before it is renewed; RFC 2177 asks clients to renew it at least every 29 minutes.
+"""
+IMAP_IDLE_TIMEOUT = 29 * 60
+
+"""
+Time to wait for the server's response to IDLE and DONE before the connection is considered lost.
+"""
+IMAP_RESPONSE_TIMEOUT = 60
+
+IMAP_EXISTS = re.compile(rb'^\* \d+ EXISTS', re.IGNORECASE)
+
+"""
+Interval in s for checking for new mails with NOOP on servers without IDLE.
+"""
+IMAP_POLL_INTERVAL = 30
+
+def _socket_lines(sock):
+    """
+    Read lines from the socket of an imaplib connection, with a timeout per line.
+
+    imaplib only has IDLE from Python 3.14 on and its buffered reader cannot wait with a timeout,
+    so the IDLE exchange reads the socket directly. This is safe because the server sends nothing
+    between the end of the previous command and IDLE, and nothing after the response to DONE.
+
+    Returns:
+        generator, send the timeout in s, get the next line (without CRLF) or None on timeout
+    """
+    buf = b''
+    timeout = yield
+    while True:
+        end = buf.find(b'\r\n')
+        if end >= 0:
+            line, buf = buf[:end], buf[end + 2:]
+            timeout = yield line
+            continue
+        pending = sock.pending() if hasattr(sock, 'pending') else 0 # decrypted bytes held by SSL
+        if not pending and not select.select([sock], [], [], max(timeout, 0))[0]:
+            timeout = yield None
+            continue
+        data = sock.recv(65536)
+        if not data:
+            raise imaplib.IMAP4.abort('Connection closed by server.')
+        buf += data
+
+def _untracked_tag(imap):
+    """
+    Get a tag for a command sent past imaplib, which has no IDLE before Python 3.14.
+
+    Uses the imaplib internals _new_tag() and tagged_commands, unchanged in CPython 3.x up to
+    at least 3.14 (tested with 3.11). The tag is removed from tagged_commands again, so imaplib
+    does not expect a response to it.
+    """
+    tag = imap._new_tag()
+    del imap.tagged_commands[tag]
+    return tag
+
+def poll_wait(imap, timeout=IMAP_IDLE_TIMEOUT, interval=IMAP_POLL_INTERVAL):
+    """
+    Wait for a new mail on servers without IDLE, sending NOOP every interval seconds
+    until the number of mails (EXISTS) changes or the timeout passes.
+
+    Args:
+        imap, imaplib object with open connection and selected mailbox
+        timeout, longest wait in s
+        interval, time between two NOOP commands in s
+
+    Returns:
+        exists, True if the server reported a changed number of mails
+    """
+    _, data = imap.response('EXISTS') # as reported by SELECT
+    known = data[-1]
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        imap.noop()
+        _, data = imap.response('EXISTS')
+        if data[-1] is not None and data[-1] != known:
+            return True
+
+def idle_wait(imap, timeout=IMAP_IDLE_TIMEOUT):
+    """
+    Wait with IDLE until the server reports a new mail (EXISTS) or the timeout passes.
+    Servers without IDLE are polled, see poll_wait().
+
+    imaplib only has IDLE from Python 3.14 on, so this sends IDLE past imaplib on its socket
+    (imap.sock, imap.send()) with a tag from _untracked_tag(). These internals were checked
+    against the imaplib of CPython 3.6 to 3.14 and are tested with 3.11.
+
+    Args:
+        imap, imaplib object with open connection and selected mailbox
+        timeout, longest wait in s
+
+    Returns:
+        exists, True if the server reported a new mail
+    """
+    if 'IDLE' not in imap.capabilities:
+        return poll_wait(imap, timeout)
+    tag = _untracked_tag(imap)
+    lines = _socket_lines(imap.sock)
+    next(lines)
+    imap.send(tag + b' IDLE\r\n')
+    line = lines.send(IMAP_RESPONSE_TIMEOUT)
+    if line is None:
+        raise imaplib.IMAP4.abort('No response to IDLE.')
+    if not line.startswith(b'+'):
+        raise imaplib.IMAP4.error('IDLE failed: {}'.format(line))
+    exists = False
+    deadline = time.monotonic() + timeout
+    while not exists:
+        line = lines.send(deadline - time.monotonic())
+        if line is None:
+            break
+        exists = IMAP_EXISTS.match(line) is not None
+    imap.send(b'DONE\r\n')
+    while True:
+        line = lines.send(IMAP_RESPONSE_TIMEOUT)
+        if line is None:
+            raise imaplib.IMAP4.abort('No response to DONE.')
+        if line.startswith(tag + b' '):
+            break
+        exists |= IMAP_EXISTS.match(line) is not None
+    if not line[len(tag):].strip().upper().startswith(b'OK'):
+        raise imaplib.IMAP4.error('IDLE failed: {}'.format(line))
+    return exists
+
+def watch_mail(connect, state, key, mailbox='Inbox', from_address='@rockblock.rock7.com', batch_size=IMAP_FETCH_BATCH,
+               attachments_only=False, idle_timeout=IMAP_IDLE_TIMEOUT, max_backoff=300, status=None, checkpoint=None):
+    """
+    Keep the IMAP connection open and yield the SBD attachments of new mails as soon as they arrive.
+
+    Mails are synced with sync_mail() whenever IDLE reports a new mail (EXISTS) and when IDLE is
+    renewed. If the connection drops or the server refuses a command (NO, BAD), it is reopened
+    after 1, 2, 4, ... up to max_backoff seconds.
+
+    Args:
+        connect, function returning a new, logged in imaplib object
+        state, MailSyncState
+        key, mailbox key, see sync_key()
+        mailbox, mailbox to watch
+        from_address, sender address to filter for
+        batch_size, number of mails fetched with one FETCH command
+        attachments_only, fetch only the attachments instead of whole mails, see fetch_attachments()
+        idle_timeout, longest wait in IDLE in s
+        max_backoff, longest wait before reconnecting in s
+        status, file for status messages (default: stdout)
+        checkpoint, optional function called before the state of a batch is stored, see sync_mail()
+
+    Returns:
+        sbd_list, endless generator of sbd attachments
+    """
+    backoff = 1
+    while True:
+        try:
+            imap = connect()
+            try:
+                while True:
+                    yield from sync_mail(imap, state, key, mailbox, from_address, batch_size, attachments_only, status=status,
+                                         checkpoint=checkpoint)
+                    backoff = 1
+                    idle_wait(imap, idle_timeout)
+            except imaplib.IMAP4.error as err: # also NO or BAD responses to IDLE, NOOP or the sync commands
+                lost = err
+            finally:
+                try:
+                    imap.logout()
+                except (imaplib.IMAP4.error, OSError):
+                    pass
+        except (imaplib.IMAP4.abort, OSError) as err: # while connecting; other login errors are final
+            lost = err
+        print('IMAP connection lost ({}), reconnecting in {} s'.format(lost, backoff), file=status or sys.stdout)
+        time.sleep(backoff)
+        backoff = min(2 * backoff, max_backoff)
+
+def get_messages(imap, from_address='@rockblock.rock7.com', all_messges=False, batch_size=IMAP_FETCH_BATCH, attachments_only=False,
+                 state=None, key=None, status=None):
+    """
+    Get IRIDIUM SBD messages from IMAP.
+
+    Args:
+        imap, imaplib object with open connection
+        from_address, sender address to filter for
+        unseen_only, whether to only retrieve unseen messages (default: True)
+        batch_size, number of mails fetched with one FETCH command
+        attachments_only, fetch only the attachments instead of whole mails
+        state, optional MailSyncState; only mails that arrived since the last sync are then retrieved, see sync_mail()
+        key, mailbox key for state, see sync_key()
+        status, file for error messages (default: stdout)
+
+    Returns:
+        messages, translated messages as a list of dictionaries
+    """
+    messages = []
+    if state is not None:
+        sbd_list = sync_mail(imap, state, key, from_address=from_address, batch_size=batch_size,
+                             attachments_only=attachments_only, full=all_messges, status=status)
+    else:
+        sbd_list = query_mail(imap, from_address=from_address, unseen_only=not all_messges, batch_size=batch_size,
+                              attachments_only=attachments_only, status=status)
+    for sbd in sbd_list:
+        try:
+            messages.append(translate_sbd(sbd))
+        except (ValueError, AssertionError) as err:
+            print('Error translating message: ',err, file=status)
+            pass
+    return messages
+
+def mail_sections(config):
+    """
+    Get the mailboxes configured in an ini file: the [email] section and any [email:<name>] sections.
+
+    Besides host, user and password, a section can give port, ssl (default: yes), from,
+    mailbox (default: Inbox), batch, attachments_only and state, see main().
+
+    Args:
+        config, configparser.ConfigParser with the ini file read
+
+    Returns:
+        sections, list of configparser section proxies
+    """
+    return [config[name] for name in config.sections() if name == 'email' or name.startswith('email:')]
+
+def imap_connector(section, status=None):
+    """
+    Build a function opening a new, logged in IMAP connection for a mailbox section, see mail_sections().
+    """
+    def connect():
+        print('Connecting to {} ...'.format(section['host']), file=status or sys.stdout)
+        if section.getboolean('ssl', fallback=True):
+            imap = imaplib.IMAP4_SSL(section['host'], section.getint('port', fallback=imaplib.IMAP4_SSL_PORT)) # connect to host using SSL
+        else: # e.g. a local test server
+            imap = imaplib.IMAP4(section['host'], section.getint('port', fallback=imaplib.IMAP4_PORT))
+        imap.login(section['user'], section['password']) # login to server
+        return imap
+    return connect
+
+def mailbox_attachments(section, all_messages=False, watch=False, connect=None, status=None, checkpoint=None):
+    """
+    Get the SBD attachments of one mailbox section, see mail_sections(), with its own connection and sync state.
+
+    Args:
+        section, configparser section proxy
+        all_messages, retrieve all messages, not only new ones
+        watch, keep the connection open and wait for new mails, see watch_mail() (requires a state entry)
+        connect, function opening the connection (default: imap_connector(section))
+        status, file for status messages (default: stdout)
+        checkpoint, optional function called before the sync state of a batch is stored, see sync_mail()
+
+    Returns:
+        sbd_list, generator of sbd attachments
+    """
+    connect = connect or imap_connector(section, status)
+    from_address = section.get('from', fallback='@rockblock.rock7.com')
+    mailbox = section.get('mailbox', fallback='Inbox')
+    batch_size = section.getint('batch', fallback=IMAP_FETCH_BATCH)
+    attachments_only = section.getboolean('attachments_only', fallback=False)
+    key = sync_key(section['user'], section['host'], mailbox, from_address)
+    if watch:
+        assert ('state' in section), 'Watching mailbox [{}] requires a state entry.'.format(section.name)
+    state = MailSyncState(section['state']) if 'state' in section else None
+    try:
+        if watch:
+            yield from watch_mail(connect, state, key, mailbox, from_address, batch_size, attachments_only, status=status,
+                                  checkpoint=checkpoint)
+            return
+        imap = connect()
+        try:
+            if state is not None:
+                yield from sync_mail(imap, state, key, mailbox, from_address, batch_size, attachments_only, full=all_messages,
+                                     status=status, checkpoint=checkpoint)
+            else:
+                yield from query_mail(imap, from_address, not all_messages, batch_size, attachments_only, mailbox, status)
+        finally:
+            imap.logout()
+    finally:
+        if state is not None:
+            state.close()
+
+class PrefixedStatus:
+    """
+    File-like object for the status messages of one of several threads. Each line is
+    prefixed, e.g. with the mailbox section name, and written as a whole under a lock
+    shared by all threads, so the lines of concurrent mailboxes do not interleave.
+    Every thread needs its own PrefixedStatus, as partial lines are buffered.
+    """
+
+    def __init__(self, prefix, lock, status=None):
+        self.prefix = prefix
+        self.lock = lock
+        self.status = status
+        self._line = ''
+
+    def write(self, text):
+        self._line += text
+        if '\n' in self._line:
+            lines, self._line = self._line.rsplit('\n', 1)
+            with self.lock:
+                (self.status or sys.stdout).write(''.join(self.prefix + line + '\n' for line in lines.split('\n')))
+        return len(text)
+
+    def flush(self):
+        with self.lock:
+            (self.status or sys.stdout).flush()
+
+async def ingest_mailboxes(sections, handle, all_messages=False, watch=False, queue_size=1000, connectors=None, status=None):
+    """
+    Sync many mailboxes concurrently into one shared decode queue, so the total time follows the
+    slowest mailbox instead of the sum of all of them.
+
+    imaplib is blocking, so each mailbox is synced with its own connection in its own thread,
+    which puts the attachments into a bounded asyncio.Queue. A single task translates them and
+    calls handle() in the event loop's thread. When the queue is full, the mailbox threads wait
+    until the decoder caught up. Before the sync state of a batch is stored, a mailbox thread
+    also waits until all its attachments have been handled, so none are lost if the run is
+    interrupted or handle() fails.
+
+    Args:
+        sections, mailbox sections, see mail_sections()
+        handle, function called with the section name and the translated message for each message
+        all_messages, retrieve all messages, not only new ones
+        watch, keep the connections open and wait for new mails (runs until cancelled)
+        queue_size, maximum number of attachments waiting to be translated
+        connectors, optional dictionary of connect functions by section name (default: imap_connector())
+        status, file for status messages (default: stdout), each line prefixed with the section name
+
+    Returns:
+        counts, dictionary of section name and number of attachments, or the exception that stopped the mailbox
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=queue_size)
+    connectors = connectors or {}
+    handled = {section.name: 0 for section in sections}
+    progress = threading.Condition() # notified by the decoder after each attachment
+    stopped = []
+    status_lock = threading.Lock() # held while a whole status line is written
+    def produce(section, future):
+        count = 0
+        section_status = PrefixedStatus('[{}] '.format(section.name), status_lock, status)
+        def checkpoint():
+            with progress:
+                while handled[section.name] < count:
+                    if stopped:
+                        raise RuntimeError('Decoder stopped before the attachments were handled.')
+                    progress.wait()
+        try:
+            for sbd in mailbox_attachments(section, all_messages, watch, connectors.get(section.name), section_status, checkpoint):
+                asyncio.run_coroutine_threadsafe(queue.put((section.name, sbd)), loop).result()
+                count += 1
+        except Exception as err:
+            if loop.is_closed(): # the run was interrupted, nobody is waiting for this mailbox
+                return
+            print('Error reading mailbox: {}'.format(err), file=section_status)
+            loop.call_soon_threadsafe(future.set_result, err)
+        else:
+            loop.call_soon_threadsafe(future.set_result, count)
+    async def decode():
+        decoder_status = {section.name: PrefixedStatus('[{}] '.format(section.name), status_lock, status) for section in sections}
+        try:
+            while True:
+                name, sbd = await queue.get()
+                try:
+                    msg = translate_sbd(sbd)
+                    with status_lock: # what handle() prints does not interleave with status lines either
+                        handle(name, msg)
+                except (ValueError, AssertionError, IndexError) as err:
+                    print('Error translating message: ', err, file=decoder_status[name])
+                with progress:
+                    handled[name] += 1
+                    progress.notify_all()
+                queue.task_done()
+        finally:
+            with progress:
+                stopped.append(True)
+                progress.notify_all()
+    decoder = asyncio.create_task(decode())
+    async def unless_decoder_failed(awaitable):
+        task = asyncio.ensure_future(awaitable)
+        await asyncio.wait([task, decoder], return_when=asyncio.FIRST_COMPLETED)
+        if decoder.done(): # handle() raised an exception
+            task.cancel()
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
+            decoder.result()
+        return task.result()
+    futures = []
+    for section in sections:
+        futures.append(loop.create_future())
+        # daemon threads, so an interrupted watch does not wait for connections blocked in IDLE
+        threading.Thread(target=produce, args=(section, futures[-1]), daemon=True).start()
+    try:
+        results = await unless_decoder_failed(asyncio.gather(*futures))
+        await unless_decoder_failed(queue.join())
+    finally:
+        decoder.cancel()
+    return {section.name: result for section, result in zip(sections, results)}
+
+class GPXStreamWriter:
+    """
+    Write a GPX file point by point, without building the whole GPX object tree in memory.
+
+    The header is written when the file is opened, each track point as soon as it is
+    given and the closing tags by close(). Use as context manager:
+
+        with GPXStreamWriter('track.gpx') as writer:
+            for msg in messages:
+                writer.write_message(msg)
+    """
+
+    def __init__(self, output_file, creator='AGT Message Translator', name='Artemis Global Tracker'):
+        gpx = gpxpy.gpx.GPX()
+        gpx.creator = creator
+        gpx.name = name
+        header = gpx.to_xml()
+        self.points = 0
+        self._fd = open(output_file, 'w')
+        self._fd.write(header[:header.rindex('</gpx>')])
+        self._in_track = False
+        self._in_segment = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def new_track(self, name=None):
+        """
+        Start a new track. Points written afterwards go into its first segment.
+
+        Args:
+            name, optional track name
+        """
+        self._end_track()
+        self._fd.write('  <trk>\n')
+        if name is not None:
+            self._fd.write('    <name>{}</name>\n'.format(escape(name)))
+        self._in_track = True
+
+    def new_segment(self):
+        """
+        Start a new segment in the current track.
+        """
+        if not self._in_track:
+            self.new_track()
+        self._end_segment()
+        self._fd.write('    <trkseg>')
+        self._in_segment = True
+
+    def write_point(self, point):
+        """
+        Write a track point.
+
+        Args:
+            point, gpxpy.gpx.GPXTrackPoint
+        """
+        if not self._in_segment:
+            self.new_segment()
+        self._fd.write(gpxpy.gpxfield.gpx_fields_to_xml(point, 'trkpt', '1.1', indent='      '))
+        self.points += 1
+
+    def write_message(self, msg):
+        """
+        Write the position of a translated message as track point, see message2trackpoint().
+        """
+        self.write_point(message2trackpoint(msg))
+
+    def _end_segment(self):
+        if self._in_segment:
+            self._fd.write('\n    </trkseg>\n')
+            self._in_segment = False
+
+    def _end_track(self):
+        self._end_segment()
+        if self._in_track:
+            self._fd.write('  </trk>\n')
+            self._in_track = False
+
+    def close(self):
+        """
+        Write the closing tags and close the file.
+        """
+        if self._fd.closed:
+            return
+        self._end_track()
+        self._fd.write('</gpx>')
+        self._fd.close()
+
+def write_gpx(gpx_track, output_file):
+    """
+    Write a track to a GPX file.
 
     Args:
-        data, byte array of data
+        gpx_track, the track to be written
+        output_file, the file name to be written
+    """
+    with GPXStreamWriter(output_file) as writer:
+        writer.new_track(gpx_track.name)
+        for segment in gpx_track.segments:
+            writer.new_segment()
+            for point in segment.points:
+                writer.write_point(point)
+    return
 
-    Return:
-        cs_a, checksum a
-        cs_b, checksum b
+"""
+File name pattern of SBD attachments from RockBLOCK: IMEI-MOMSN.sbd or IMEI-MOMSN.bin
+"""
+SBD_FILENAME = re.compile(r'^(\d+)-(\d+)\.(?:sbd|bin)$')
+
+def find_sbd_files(directories):
     """
-    old_settings = np.seterr(over='ignore') # Do not warn for desired overflow in this computation.
-    cs_a = np.uint8(0)
-    cs_b = np.uint8(0)
-    for ind in range(len(data)):
-        cs_a += np.uint8(data[ind])
-        cs_b += cs_a
-    np.seterr(**old_settings)
-    return cs_a, cs_b
+    Find all .sbd and .bin files below the given directories.
+
+    Args:
+        directories, list of directory names
 
-def translate_sbd(message):
+    Returns:
+        filelist, list of file names
     """
-    Parse binary SBD message from Sparkfun Artemis Global Tracker.
+    filelist = []
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            for filename in files:
+                if os.path.splitext(filename)[1] in ['.sbd', '.bin']:
+                    filelist.append(os.path.join(root, filename))
+    return filelist
+
+def parse_sbd_filename(filename):
+    """
+    Extract IMEI and MOMSN from the file name of an SBD attachment.
 
     Args:
-        message, binary message as byte array
+        filename, file name, e.g. 300434063012345-123.sbd
 
     Returns:
-        data, translated message as dictionary
+        imei, IMEI as string or None if the name does not match
+        momsn, MOMSN as int or None if the name does not match
     """
-    data = {}
-    if message[0] == TrackerMessageFields.STX.value:
-        ind = 0
-    else: # assuming gateway header
-        ind = 5
-    assert (message[ind] == TrackerMessageFields.STX.value), 'STX marker not found.'
-    ind += 1
-    while (message[ind] != TrackerMessageFields.ETX.value):
-        field = TrackerMessageFields(message[ind])
-        ind += 1
-        if isinstance(FIELD_TYPE[field], int): # length in bytes
-            field_len = FIELD_TYPE[field]
-            if field == TrackerMessageFields.DATETIME:
-                values = struct.unpack('HBBBBB', message[ind:ind+field_len])
-                data[field.name] = datetime.datetime(*values)
-            elif field_len > 0:
-                data[field.name] = message[ind:ind+field_len]
-        elif isinstance(FIELD_TYPE[field], np.dtype): # dtype of scalar
-            field_len = FIELD_TYPE[field].itemsize
-            data[field.name] = np.frombuffer(message[ind:ind+field_len], dtype=FIELD_TYPE[field])[0]
-        elif isinstance(FIELD_TYPE[field], tuple): # dtype and length of array
-            field_len = FIELD_TYPE[field][0].itemsize * FIELD_TYPE[field][1]
-            data[field.name] = np.frombuffer(message[ind:ind+field_len], dtype=FIELD_TYPE[field][0])
+    match = SBD_FILENAME.match(os.path.basename(filename))
+    if match is None:
+        return None, None
+    return match.group(1), int(match.group(2))
+
+def translate_file(filename):
+    """
+    Read and translate one SBD file.
+
+    Args:
+        filename, file name
+
+    Returns:
+        identity, (size, mtime in ns, SHA-1 of the content) of the file as it was read
+        msg_trans, translated message as dictionary, or None if translation failed
+        error, error message, or None if translation succeeded
+    """
+    with open(filename, 'rb') as fd:
+        mtime_ns = os.fstat(fd.fileno()).st_mtime_ns
+        msg_bin = fd.read()
+    identity = (len(msg_bin), mtime_ns, hashlib.sha1(msg_bin).hexdigest())
+    try:
+        return identity, translate_sbd(msg_bin), None
+    except (ValueError, AssertionError, IndexError) as err:
+        return identity, None, str(err)
+
+def _translate_file_chunk(filelist):
+    """
+    Translate a chunk of files in a worker process.
+
+    Args:
+        filelist, list of file names
+
+    Returns:
+        results, list of (file name, identity, translated message, error message), see translate_file()
+    """
+    results = []
+    for filename in filelist:
+        try:
+            results.append((filename,) + translate_file(filename))
+        except OSError as err:
+            results.append((filename, None, None, str(err)))
+    return results
+
+"""
+Field decoders by field name, to restore the value types of translated messages read back from JSON
+"""
+FIELD_DECODERS_BY_NAME = {decoder.name: decoder for decoder in FIELD_DECODERS if decoder is not None}
+
+def _cache_record(msg_trans):
+    """
+    Encode a translated message as JSON for the DecodeCache, see json_value().
+    """
+    return json.dumps({name: json_value(value) for name, value in msg_trans.items()},
+                      separators=(',', ':'), allow_nan=False)
+
+def _cached_message(record):
+    """
+    Decode a translated message stored by _cache_record(), restoring the types translate_sbd() returns.
+    """
+    msg_trans = json.loads(record)
+    for name, value in msg_trans.items():
+        decoder = FIELD_DECODERS_BY_NAME.get(name)
+        if decoder is None:
+            continue
+        if decoder.kind == KIND_DATETIME:
+            msg_trans[name] = datetime.datetime.fromisoformat(value)
+        elif decoder.kind == KIND_ARRAY:
+            msg_trans[name] = np.array([np.nan if item is None else item for item in value], dtype=decoder.dtype)
+        elif decoder.kind == KIND_BYTES:
+            msg_trans[name] = bytes.fromhex(value)
+        elif value is None: # non-finite float, see _json_float()
+            msg_trans[name] = math.nan
+    return msg_trans
+
+"""
+Version of the DecodeCache schema; files of older versions are emptied when opened.
+Version 1 stores the translated messages as JSON, version 0 stored them pickled.
+"""
+DECODE_CACHE_VERSION = 1
+
+class DecodeCache:
+    """
+    On-disk SQLite cache of translated SBD files.
+
+    Entries are keyed by absolute path and valid as long as size and mtime of the file
+    are unchanged. If only the mtime changed, the content hash decides whether the
+    entry can still be used. Failed translations are cached as well. Translated messages
+    are stored as JSON, so opening a cache file from elsewhere cannot run any code.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        self._used = []
+        self._db = sqlite3.connect(filename)
+        if self._db.execute('PRAGMA user_version').fetchone()[0] < DECODE_CACHE_VERSION:
+            self._db.execute('DROP TABLE IF EXISTS decoded')
+            self._db.execute('PRAGMA user_version = {}'.format(DECODE_CACHE_VERSION))
+        self._db.execute('CREATE TABLE IF NOT EXISTS decoded (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+                         'hash TEXT, record TEXT, error TEXT, last_used REAL)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Commit pending changes and close the database.
+        """
+        self.commit()
+        self._db.close()
+
+    def commit(self):
+        """
+        Commit pending changes, including the last used time of all entries looked up.
+        """
+        now = time.time()
+        self._db.executemany('UPDATE decoded SET last_used = ? WHERE path = ?', ((now, path) for path in self._used))
+        self._used = []
+        self._db.commit()
+
+    def lookup(self, filename):
+        """
+        Look up a file.
+
+        Args:
+            filename, file name
+
+        Returns:
+            None if the file is not cached or has changed, otherwise a tuple
+            msg_trans, translated message as dictionary, or None if translation failed
+            error, error message, or None if translation succeeded
+        """
+        path = os.path.abspath(filename)
+        row = self._db.execute('SELECT size, mtime_ns, hash, record, error FROM decoded WHERE path = ?', (path,)).fetchone()
+        try:
+            stat = os.stat(path) if row is not None else None
+        except OSError:
+            stat = None
+        if stat is None or stat.st_size != row[0]:
+            self.misses += 1
+            return None
+        if stat.st_mtime_ns != row[1]:
+            with open(path, 'rb') as fd:
+                if hashlib.sha1(fd.read()).hexdigest() != row[2]:
+                    self.misses += 1
+                    return None
+            self._db.execute('UPDATE decoded SET mtime_ns = ? WHERE path = ?', (stat.st_mtime_ns, path))
+        self.hits += 1
+        self._used.append(path)
+        return (_cached_message(row[3]) if row[3] is not None else None), row[4]
+
+    def store(self, filename, identity, msg_trans, error):
+        """
+        Store the translation of a file.
+
+        Args:
+            filename, file name
+            identity, msg_trans, error, as returned by translate_file()
+        """
+        size, mtime_ns, content_hash = identity
+        self._db.execute('INSERT OR REPLACE INTO decoded VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (os.path.abspath(filename), size, mtime_ns, content_hash,
+                          _cache_record(msg_trans) if msg_trans is not None else None, error, time.time()))
+
+    def compact(self, max_age_days=None):
+        """
+        Evict entries of files which no longer exist or, optionally, which have not been
+        used for a while, and reclaim the space in the database file.
+
+        Args:
+            max_age_days, evict entries not used for this many days (default: keep them)
+
+        Returns:
+            evicted, number of evicted entries
+        """
+        self.commit()
+        evict = [(path,) for (path,) in self._db.execute('SELECT path FROM decoded') if not os.path.exists(path)]
+        self._db.executemany('DELETE FROM decoded WHERE path = ?', evict)
+        evicted = len(evict)
+        if max_age_days is not None:
+            evicted += self._db.execute('DELETE FROM decoded WHERE last_used < ?',
+                                        (time.time() - max_age_days * 86400,)).rowcount
+        self._db.commit()
+        self._db.execute('VACUUM')
+        return evicted
+
+def _sort_key(result):
+    """
+    Order translated files by IMEI and MOMSN, files not named IMEI-MOMSN last by name.
+    """
+    imei, momsn, filename, _ = result
+    if imei is None:
+        return (1, '', 0, filename)
+    return (0, imei, momsn, filename)
+
+def translate_files_parallel(filelist, jobs=None, chunk_size=512, cache=None):
+    """
+    Translate many files in parallel worker processes.
+
+    Args:
+        filelist, list of file names
+        jobs, number of worker processes (default: number of CPUs)
+        chunk_size, number of files handed to a worker at once
+        cache, optional DecodeCache; only files not found in it are translated
+
+    Returns:
+        results, list of (IMEI, MOMSN, file name, translated message), in MOMSN order per IMEI
+        errors, list of (file name, error message)
+    """
+    results = []
+    errors = []
+    def add(filename, msg_trans, error):
+        if error is not None:
+            errors.append((filename, error))
         else:
-            raise ValueError('Unknown entry in FIELD_TYPE list: {}'.format(FIELD_TYPE[field]))
-        if field in CONVERSION_FACTOR:
-            data[field.name] = float(data[field.name]) * CONVERSION_FACTOR[field]
-        ind += field_len
-    ind += 1 # ETX
-    cs_a, cs_b = checksum(message[:ind])
-    assert (message[ind] == cs_a), 'Checksum mismatch.'
-    assert (message[ind+1] == cs_b), 'Checksum mismatch.'
-    return data
+            imei, momsn = parse_sbd_filename(filename)
+            results.append((imei, momsn, filename, msg_trans))
+    todo = filelist
+    if cache is not None:
+        todo = []
+        for filename in filelist:
+            entry = cache.lookup(filename)
+            if entry is None:
+                todo.append(filename)
+            else:
+                add(filename, *entry)
+    if todo:
+        chunks = [todo[ind:ind+chunk_size] for ind in range(0, len(todo), chunk_size)]
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for chunk_results in executor.map(_translate_file_chunk, chunks):
+                for filename, identity, msg_trans, error in chunk_results:
+                    if cache is not None and identity is not None:
+                        cache.store(filename, identity, msg_trans, error)
+                    add(filename, msg_trans, error)
+    if cache is not None:
+        cache.commit()
+    results.sort(key=_sort_key)
+    return results, errors
 
-def message2trackpoint(msg):
+"""
+Separator of the mails in an mbox file: a line starting with 'From '. Lines in the mails
+starting with 'From ' are quoted as '>From ' by the mail programs writing mbox files.
+"""
+MBOX_FROM = b'\nFrom '
+
+"""
+Approximate size of the parts of an mbox file handed to the worker processes
+"""
+MBOX_CHUNK_SIZE = 1 << 22
+
+"""
+End of the header of a mail: an empty line, with LF or CRLF line endings
+"""
+MAIL_HEADER_END = re.compile(rb'\r?\n\r?\n')
+
+def mbox_messages(buf, start=0, end=None):
     """
-    Creates a GPX trackpoint from a translated IRIDIUM message.
+    Find the mails in (a part of) an mbox file, without copying the file.
 
     Args:
-        msg, translated SBD message
+        buf, contents of the mbox file, e.g. an mmap object
+        start, offset to start at, the start of the file or of a 'From ' line
+        end, offset to stop at (default: end of buf)
+
+    Yields:
+        offset, start of the mail after its 'From ' line
+        length, length of the mail
+    """
+    if end is None:
+        end = len(buf)
+    if buf[start:start+len(MBOX_FROM)-1] != MBOX_FROM[1:]:
+        start = buf.find(MBOX_FROM, start, end)
+        if start < 0:
+            return
+        start += 1
+    while start < end:
+        following = buf.find(MBOX_FROM, start, end)
+        stop = end if following < 0 else following + 1
+        header = buf.find(b'\n', start, stop)
+        if header >= 0:
+            yield header + 1, stop - header - 1
+        start = stop
+
+def mbox_chunks(filename, chunk_size=MBOX_CHUNK_SIZE):
+    """
+    Split an mbox file into parts of about chunk_size bytes at the start of mails.
+
+    Args:
+        filename, mbox file name
+        chunk_size, approximate size of the parts in bytes
 
     Returns:
-        pkt, GPX trackpoint corresponding to message data
+        chunks, list of (file name, start, end) of the parts
     """
-    return gpxpy.gpx.GPXTrackPoint(
-                msg['LAT'], msg['LON'], elevation=msg['ALT'], time=msg['DATETIME'],
-                comment='{} hPa'.format(msg['PRESS']) if 'PRESS' in msg else None)
+    size = os.path.getsize(filename)
+    if size == 0:
+        return []
+    bounds = [0]
+    with open(filename, 'rb') as fd:
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for pos in range(chunk_size, size, chunk_size):
+                found = mm.find(MBOX_FROM, max(pos, bounds[-1]))
+                if found < 0:
+                    break
+                bounds.append(found + 1)
+    bounds.append(size)
+    return [(filename, start, end) for start, end in zip(bounds[:-1], bounds[1:]) if start < end]
 
-def query_mail(imap, from_address='@rockblock.rock7.com', unseen_only=True):
+def find_maildir_files(directory):
     """
-    Query IMAP server for new mails from IRIDIUM gateway and extract new messages.
+    Find all mails of a Maildir directory, including its subfolders.
 
     Args:
-        imap, imaplib object with open connection
-        from_address, sender address to filter for
-        unseen_only, whether to only retrieve unseen messages (default: True)
+        directory, Maildir directory name
 
     Returns:
-        sbd_list, list of sbd attachments
+        filelist, list of file names in the cur and new directories
     """
-    sbd_list = []
-    imap.select('Inbox')
-    criteria = ['FROM', from_address]
-    if unseen_only:
-        criteria.append('(UNSEEN)')
-    retcode, messages = imap.search(None, *criteria)
-    for num in messages[0].split():
-        typ, data = imap.fetch(num, '(RFC822)')
-        raw_message = data[0][1]
-        message = email.message_from_bytes(raw_message)
-        # Download attachments
-        for part in message.walk():
-            if part.get_content_maintype() == 'multipart':
-                continue
-            if part.get('Content-Disposition') is None:
-                continue
-            filename = part.get_filename()
-            if bool(filename):
-                _, fileext = os.path.splitext(filename)
-                if fileext in ['.sbd', '.bin']:
-                    sbd_list.append(part.get_payload(decode=True))
+    filelist = []
+    for root, _, files in os.walk(directory):
+        if os.path.basename(root) in ('cur', 'new'):
+            filelist.extend(os.path.join(root, filename) for filename in sorted(files))
+    return filelist
+
+def mail_from_matches(raw_message, from_address):
+    """
+    Check the sender of a mail, like the FROM criterion of an IMAP search, parsing only its header.
+
+    Args:
+        raw_message, mail as bytes
+        from_address, part of the sender address to look for, or None for all mails
+
+    Returns:
+        True if the sender matches
+    """
+    if not from_address:
+        return True
+    end = MAIL_HEADER_END.search(raw_message)
+    header = raw_message[:end.start()] if end is not None else raw_message
+    if from_address.lower().encode() not in bytes(header).lower(): # most mails of an export are rejected here
+        return False
+    header = email.parser.BytesHeaderParser().parsebytes(header)
+    return from_address.lower() in str(header.get('From', '')).lower()
+
+def _chunk_mails(chunk):
+    """
+    Read the mails of a chunk of a mail export.
+
+    Args:
+        chunk, (file name, start, end) of a part of an mbox file, see mbox_chunks(), or list of Maildir files
+
+    Yields:
+        label, file name and, for mbox files, offset of the mail
+        raw_message, mail as bytes
+    """
+    if isinstance(chunk, list):
+        for filename in chunk:
+            with open(filename, 'rb') as fd:
+                yield filename, fd.read()
+        return
+    filename, start, end = chunk
+    with open(filename, 'rb') as fd:
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            for offset, length in mbox_messages(mm, start, end):
+                yield '{}@{}'.format(filename, offset), mm[offset:offset+length]
+
+def _translate_mail_chunk(chunk, from_address):
+    """
+    Translate the SBD attachments of a chunk of a mail export in a worker process.
+
+    Args:
+        chunk, part of an mbox file or list of Maildir files, see _chunk_mails()
+        from_address, part of the sender address to filter for, or None for all mails
+
+    Returns:
+        mails, number of mails read
+        matched, number of mails from from_address
+        results, list of (attachment file name or, on errors, mail label and attachment file name, translated message, error message)
+    """
+    mails = 0
+    matched = 0
+    results = []
+    for label, raw_message in _chunk_mails(chunk):
+        mails += 1
+        if not mail_from_matches(raw_message, from_address):
+            continue
+        matched += 1
+        # Warnings go to stderr: the stdout of the workers may be the NDJSON output
+        for filename, content in sbd_attachment_files(email.message_from_bytes(raw_message), sys.stderr):
+            try:
+                results.append((filename, translate_sbd(content), None))
+            except (ValueError, AssertionError, IndexError) as err:
+                results.append(('{}:{}'.format(label, filename), None, str(err)))
+    return mails, matched, results
+
+def translate_mail_exports_parallel(paths, from_address='@rockblock.rock7.com', jobs=None, chunk_size=512, unique=False, status=None):
+    """
+    Translate the SBD attachments of mail exports (mbox files or Maildir directories) in parallel worker processes.
+    mbox files are memory-mapped and split at the start of mails, so a single large export is spread over all workers.
+
+    Args:
+        paths, list of mbox file names or Maildir directory names
+        from_address, part of the sender address to filter for, or None for all mails
+        jobs, number of worker processes (default: number of CPUs)
+        chunk_size, number of Maildir files handed to a worker at once
+        unique, keep each IMEI and MOMSN only once, e.g. for exports holding the same mail in several folders
+        status, file to print the number of mails to (default: stdout)
+
+    Returns:
+        results, list of (IMEI, MOMSN, attachment file name, translated message), in MOMSN order per IMEI
+        errors, list of (mail label and attachment file name, error message)
+    """
+    chunks = []
+    for path in paths:
+        if os.path.isdir(path):
+            filelist = find_maildir_files(path)
+            chunks.extend(filelist[ind:ind+chunk_size] for ind in range(0, len(filelist), chunk_size))
+        else:
+            chunks.extend(mbox_chunks(path))
+    results = []
+    errors = []
+    mails = 0
+    matched = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for chunk_mails, chunk_matched, chunk_results in executor.map(_translate_mail_chunk, chunks, [from_address] * len(chunks)):
+            mails += chunk_mails
+            matched += chunk_matched
+            for filename, msg_trans, error in chunk_results:
+                if error is not None:
+                    errors.append((filename, error))
                 else:
-                    print('query_mail: unrecognized file extension {} of attachment.'.format(fileext))
-    return sbd_list
+                    imei, momsn = parse_sbd_filename(filename)
+                    results.append((imei, momsn, filename, msg_trans))
+    print('Read {} mails, {} from {}'.format(mails, matched, from_address or 'any sender'), file=status)
+    results.sort(key=_sort_key)
+    if unique:
+        kept = [result for ind, result in enumerate(results)
+                if result[0] is None or ind == 0 or result[:2] != results[ind-1][:2]]
+        print('Skipped {} duplicate attachments'.format(len(results) - len(kept)), file=status)
+        results = kept
+    return results, errors
 
-def get_messages(imap, from_address='@rockblock.rock7.com', all_messges=False):
+def _json_float(value):
     """
-    Get IRIDIUM SBD messages from IMAP.
+    Convert a float for JSON, which has no NaN or infinity: non-finite values become null.
+    """
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+def _json_array(value):
+    """
+    Convert an array for JSON, with non-finite floats as null.
+    """
+    if value.dtype.kind == 'f' and not np.isfinite(value).all():
+        return [_json_float(item) if item is not None else None for item in value.tolist()]
+    return value.tolist()
+
+"""
+Conversion of the value types in translated messages for JSON, looked up by exact type.
+None marks types JSON handles natively, which are passed through unchanged.
+"""
+JSON_CONVERTERS = {
+        int: None,
+        float: _json_float,
+        str: None,
+        bool: None,
+        datetime.datetime: datetime.datetime.isoformat,
+        np.ndarray: _json_array,
+        np.ma.MaskedArray: _json_array,
+        bytes: bytes.hex,
+        np.datetime64: str,
+        np.float64: _json_float,
+        np.float32: _json_float,
+        np.bool_: bool
+}
+JSON_CONVERTERS.update(dict.fromkeys([np.uint8, np.uint16, np.uint32, np.uint64,
+                                      np.int8, np.int16, np.int32, np.int64], int))
+
+def json_value(value):
+    """
+    Convert a value of a translated message into something JSON can represent.
+    """
+    convert = JSON_CONVERTERS.get(type(value), _json_fallback)
+    return value if convert is None else convert(value)
+
+def _json_fallback(value):
+    """
+    Conversion of values whose type is not in JSON_CONVERTERS.
+    """
+    if isinstance(value, (float, np.floating)):
+        return _json_float(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return _json_array(value)
+    return value
+
+def _status_file(output_file):
+    """
+    Where to print status messages: stderr if the output goes to stdout ('-'), else stdout.
+    """
+    return sys.stderr if output_file == '-' else sys.stdout
+
+class NDJSONWriter:
+    """
+    Write translated messages as newline delimited JSON (one object per line) to a file
+    or to stdout, e.g. to pipe them into other tools.
+
+    Values are converted with json_value() and encoded by the C encoder of the json module,
+    without a default= fallback. Non-finite floats are written as null, which keeps every line
+    valid JSON; anything else the converters miss raises ValueError. Lines are collected and written in blocks of lines_per_write,
+    so writing keeps up with decoding. Use as context manager:
+
+        with NDJSONWriter('-') as writer:
+            for msg in messages:
+                writer.write_message(msg)
+    """
+
+    def __init__(self, output_file='-', lines_per_write=1024):
+        self.messages = 0
+        self.lines_per_write = lines_per_write
+        self._own_fd = output_file != '-'
+        self._fd = open(output_file, 'w', buffering=1 << 20) if self._own_fd else sys.stdout
+        self._encode = json.JSONEncoder(separators=(',', ':'), check_circular=False, allow_nan=False).encode
+        self._lines = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write_message(self, msg, extra=None):
+        """
+        Write one translated message.
+
+        Args:
+            msg, translated message (dictionary or TrackerMessage)
+            extra, optional dictionary of additional keys written in front of the fields (e.g. IMEI and MOMSN)
+        """
+        record = dict(extra) if extra else {}
+        converters = JSON_CONVERTERS
+        for name, value in msg.items():
+            convert = converters.get(type(value), _json_fallback)
+            record[name] = value if convert is None else convert(value)
+        self._lines.append(self._encode(record))
+        self.messages += 1
+        if len(self._lines) >= self.lines_per_write:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the collected lines.
+        """
+        if self._lines:
+            self._lines.append('')
+            self._fd.write('\n'.join(self._lines))
+            self._lines = []
+        self._fd.flush()
+
+    def close(self):
+        """
+        Write the remaining lines and close the file (stdout is left open).
+        """
+        if self._fd is None:
+            return
+        self.flush()
+        if self._own_fd:
+            self._fd.close()
+        self._fd = None
+
+def write_ndjson(results, output_file):
+    """
+    Write translated messages as newline delimited JSON, one object per message.
 
     Args:
-        imap, imaplib object with open connection
-        from_address, sender address to filter for
-        unseen_only, whether to only retrieve unseen messages (default: True)
+        results, list of (IMEI, MOMSN, file name, translated message)
+        output_file, the file name to be written, or '-' for stdout
+    """
+    with NDJSONWriter(output_file) as writer:
+        for imei, momsn, _, msg in results:
+            writer.write_message(msg, {'IMEI': imei, 'MOMSN': momsn})
+    return
+
+def csv_value(value):
+    """
+    Convert a value of a translated message into a CSV cell.
+    """
+    value = json_value(value)
+    if isinstance(value, list):
+        return ' '.join(str(item) if item is not None else '' for item in value)
+    return value
+
+def write_csv(results, output_file):
+    """
+    Write translated messages as CSV, one row per message and one column per field.
+
+    Args:
+        results, list of (IMEI, MOMSN, file name, translated message)
+        output_file, the file name to be written
+    """
+    names = set()
+    for result in results:
+        names.update(result[3])
+    columns = ['IMEI', 'MOMSN'] + [field.name for field in TrackerMessageFields if field.name in names]
+    with open(output_file, 'w', newline='') as fd:
+        writer = csv.writer(fd)
+        writer.writerow(columns)
+        for imei, momsn, _, msg in results:
+            writer.writerow([imei, momsn] + [csv_value(msg[name]) if name in msg else '' for name in columns[2:]])
+    return
+
+def partition_key(msg, filename=None):
+    """
+    Identify the tracker a message comes from.
+
+    Args:
+        msg, translated message
+        filename, optional name of the file the message was read from
 
     Returns:
-        messages, translated messages as a list of dictionaries
+        key, SOURCE if the message includes it, otherwise the IMEI from the file name, or 'unknown'
     """
-    messages = []
-    sbd_list = query_mail(imap, from_address=from_address, unseen_only=not all_messges)
-    for sbd in sbd_list:
-        try:
-            messages.append(translate_sbd(sbd))
-        except (ValueError, AssertionError) as err:
-            print('Error translating message: ',err)
-            pass
-    return messages
+    if 'SOURCE' in msg:
+        return str(msg['SOURCE'])
+    if filename is not None:
+        imei, _ = parse_sbd_filename(filename)
+        if imei is not None:
+            return imei
+    return 'unknown'
 
-def write_gpx(gpx_track, output_file):
+def _write_partition_gpx(output_file, tracks):
     """
-    Write a track to a GPX file.
+    Write the tracks of one tracker into a GPX file, run in a worker process.
 
     Args:
-        gpx_track, the track to be written
         output_file, the file name to be written
+        tracks, list of (track name, list of translated messages)
+
+    Returns:
+        output_file, the file name written
+        points, number of track points written
+    """
+    with GPXStreamWriter(output_file) as writer:
+        for name, msgs in tracks:
+            writer.new_track(name)
+            for msg in msgs:
+                writer.write_message(msg)
+    return output_file, writer.points
+
+def write_partitioned_gpx(entries, output_dir, jobs=None):
+    """
+    Write one GPX file per tracker, with one track per UTC day, in parallel worker processes.
+
+    Args:
+        entries, iterable of (tracker key, translated message), see partition_key()
+        output_dir, directory for the GPX files, named <tracker key>.gpx
+        jobs, number of worker processes (default: number of CPUs)
+
+    Returns:
+        written, list of (file name, number of track points)
+    """
+    partitions = {}
+    for key, msg in entries:
+        if 'LAT' not in msg or 'LON' not in msg:
+            continue
+        day = msg['DATETIME'].strftime('%Y-%m-%d') if 'DATETIME' in msg else 'unknown'
+        partitions.setdefault(key, {}).setdefault(day, []).append(msg)
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = []
+        for key, days in sorted(partitions.items()):
+            tracks = []
+            for day, msgs in sorted(days.items()):
+                if day != 'unknown':
+                    msgs.sort(key=lambda msg: msg['DATETIME'])
+                tracks.append((day, msgs))
+            futures.append(executor.submit(_write_partition_gpx, os.path.join(output_dir, key + '.gpx'), tracks))
+        for future in futures:
+            written.append(future.result())
+    return written
+
+"""
+Output formats of the bulk mode, by file extension.
+"""
+OUTPUT_FORMATS = {'.ndjson': 'ndjson', '.jsonl': 'ndjson', '.json': 'ndjson', '.csv': 'csv', '.gpx': 'gpx'}
+
+def bulk_main(directories, output_file, output_format=None, jobs=None, chunk_size=512, cache_file=None, split=False, quality=False,
+              mail_export=False, from_address='@rockblock.rock7.com', unique=False):
+    """
+    Translate all SBD files below the given directories in parallel and write them to one output file.
+
+    Args:
+        directories, list of directory names, or with mail_export, mbox file names and Maildir directory names
+        output_file, the file name to be written ('-' for NDJSON on stdout)
+        output_format, 'ndjson', 'csv' or 'gpx' (default: from the output file extension)
+        jobs, number of worker processes (default: number of CPUs)
+        chunk_size, number of files handed to a worker at once
+        cache_file, optional SQLite file caching translations between runs (not used with mail_export)
+        split, write one GPX file per tracker into the output_file directory (see write_partitioned_gpx())
+        quality, leave out messages flagged by quality_flags()
+        mail_export, translate the attachments of mail exports instead of SBD files (see translate_mail_exports_parallel())
+        from_address, sender address to filter the mails of mail exports for
+        unique, write each IMEI and MOMSN of mail exports only once
     """
-    gpx = gpxpy.gpx.GPX()
-    gpx.creator = 'AGT Message Translator'
-    gpx.name = 'Artemis Global Tracker'
-    gpx.tracks.append(gpx_track)
-    with open(output_file, 'w') as fd:
-        fd.write(gpx.to_xml())
+    if split:
+        output_format = 'gpx'
+    if output_format is None:
+        output_format = OUTPUT_FORMATS.get(os.path.splitext(output_file)[1].lower(), 'ndjson')
+    status = _status_file(output_file)
+    if mail_export:
+        print('Translating attachments of {} mail exports ...'.format(len(directories)), file=status)
+        results, errors = translate_mail_exports_parallel(directories, from_address=from_address, jobs=jobs,
+                                                          chunk_size=chunk_size, unique=unique, status=status)
+    elif cache_file:
+        filelist = find_sbd_files(directories)
+        print('Translating {} files ...'.format(len(filelist)), file=status)
+        with DecodeCache(cache_file) as cache:
+            results, errors = translate_files_parallel(filelist, jobs=jobs, chunk_size=chunk_size, cache=cache)
+            print('Decode cache: {} hits, {} misses'.format(cache.hits, cache.misses), file=status)
+    else:
+        filelist = find_sbd_files(directories)
+        print('Translating {} files ...'.format(len(filelist)), file=status)
+        results, errors = translate_files_parallel(filelist, jobs=jobs, chunk_size=chunk_size)
+    for filename, err in errors:
+        print('Error translating message {}: {}'.format(filename, err), file=status)
+    if quality:
+        flags = quality_flags(message_columns([msg for _, _, _, msg in results]),
+                              tracker=np.array([partition_key(msg, filename) for _, _, filename, msg in results]))
+        for name, count in quality_summary(flags).items():
+            print('Quality: {} messages flagged with {}'.format(count, name), file=status)
+        results = [result for result, flag in zip(results, flags) if not flag]
+    print('Writing {} messages to {}'.format(len(results), output_file), file=status)
+    if output_format == 'csv':
+        write_csv(results, output_file)
+    elif split:
+        for filename, points in write_partitioned_gpx(((partition_key(msg, filename), msg) for _, _, filename, msg in results),
+                                                      output_file, jobs=jobs):
+            print('Wrote {} track points to {}'.format(points, filename), file=status)
+    elif output_format == 'gpx':
+        with GPXStreamWriter(output_file) as writer:
+            for _, _, _, msg in results:
+                if 'LAT' in msg and 'LON' in msg:
+                    writer.write_message(msg)
+    else:
+        write_ndjson(results, output_file)
     return
 
-def main(filelist, use_imap=False, all_messages=False, output_file=None):
+def main(filelist, use_imap=False, all_messages=False, output_file=None, archive=False, stream=False, cache_file=None,
+         split=False, jobs=None, text_mofields=None, ndjson_file=None, watch=False):
     """
     Main function.
     """
-    if output_file:
-        gpx_segment = gpxpy.gpx.GPXTrackSegment()
+    gpx_writer = GPXStreamWriter(output_file) if output_file and not split else None
+    partitions = [] if output_file and split else None
+    ndjson_writer = NDJSONWriter(ndjson_file) if ndjson_file else None
+    status = _status_file(ndjson_file)
+    def output(msg, label=(), filename=None, extra=None):
+        if ndjson_writer:
+            ndjson_writer.write_message(msg, extra)
+        else:
+            print(*label, msg)
+        if gpx_writer:
+            gpx_writer.write_message(msg)
+        elif partitions is not None:
+            partitions.append((partition_key(msg, filename), msg))
+    def file_record(filename, **extra):
+        imei, momsn = parse_sbd_filename(filename)
+        if imei is not None:
+            extra.update(IMEI=imei, MOMSN=momsn)
+        extra['file'] = filename
+        return extra
     if use_imap:
         config = configparser.ConfigParser()
         config.read(filelist[0])
-        hostname = config['email']['host']
-        print('Connecting to {} ...'.format(hostname))
-        imap = imaplib.IMAP4_SSL(hostname) # connect to host using SSL
-        imap.login(config['email']['user'], config['email']['password']) # login to server
-        messages = get_messages(imap, from_address=config['email'].get('from', fallback='@rockblock.rock7.com'), all_messges=all_messages)
-        imap.close()
-        for msg in messages:
-            print(msg)
-            if output_file:
-                gpx_segment.points.append(message2trackpoint(msg))
-    else:
-        for filename in filelist:
-            with open(filename,'rb') as fd:
-                msg_bin = fd.read()
+        sections = mail_sections(config)
+        assert (len(sections) > 0), 'No [email] section in {}.'.format(filelist[0])
+        if len(sections) == 1 and sections[0].name == 'email' and not watch:
+            for sbd in mailbox_attachments(sections[0], all_messages, status=status):
                 try:
-                    msg_trans = translate_sbd(msg_bin)
+                    msg = translate_sbd(sbd)
                 except (ValueError, AssertionError, IndexError) as err:
-                    print('Error translating message {}: {}'.format(filename, err))
+                    print('Error translating message: ', err, file=status)
+                    continue
+                output(msg)
+        else:
+            def handle(name, msg):
+                if len(sections) > 1:
+                    output(msg, (name,), extra={'mailbox': name})
+                else:
+                    output(msg)
+                if watch: # deliver each message right away
+                    if ndjson_writer:
+                        ndjson_writer.flush()
+                    else:
+                        sys.stdout.flush()
+            try:
+                counts = asyncio.run(ingest_mailboxes(sections, handle, all_messages=all_messages, watch=watch, status=status))
+                for name, count in counts.items():
+                    if not isinstance(count, Exception):
+                        print('[{}]: {} messages'.format(name, count), file=status)
+            except KeyboardInterrupt:
+                pass
+    elif archive:
+        for filename in filelist:
+            for offset, msg_trans in read_archive(filename, status=status):
+                output(msg_trans, (filename, offset), extra={'file': filename, 'offset': offset})
+    elif text_mofields is not None:
+        messages = []
+        for filename in filelist:
+            with open(filename, 'rb') as f:
+                messages.append(f.read())
+        columns, valid = translate_text_batch(messages, text_mofields)
+        for row in np.flatnonzero(~valid):
+            print('Error translating message {}: {}'.format(filelist[row], 'Malformed text message.'), file=status)
+        for row, msg_trans in batch_messages(columns, valid):
+            output(msg_trans, (filelist[row],), filelist[row], file_record(filelist[row]))
+    elif stream:
+        for filename in filelist:
+            decoder = StreamDecoder()
+            for msg_trans in decode_stream(read_chunks(filename), decoder):
+                output(msg_trans, (filename,), extra={'file': filename})
+            stats = decoder.stats()
+            print('{}: {} messages, {} resyncs, {} bytes skipped'.format(filename, stats['messages'], stats['resyncs'], stats['skipped_bytes']), file=status)
+    else:
+        cache = DecodeCache(cache_file) if cache_file else None
+        try:
+            for filename in filelist:
+                entry = cache.lookup(filename) if cache else None
+                if entry is None:
+                    identity, msg_trans, err = translate_file(filename)
+                    if cache:
+                        cache.store(filename, identity, msg_trans, err)
+                else:
+                    msg_trans, err = entry
+                if err is not None:
+                    print('Error translating message {}: {}'.format(filename, err), file=status)
                     continue
-                print(filename, msg_trans)
-                if output_file:
-                    gpx_segment.points.append(message2trackpoint(msg_trans))
-    if output_file:
-        gpx_track = gpxpy.gpx.GPXTrack()
-        gpx_track.segments.append(gpx_segment)
-        print('Writing {}'.format(output_file))
-        write_gpx(gpx_track, output_file)
+                output(msg_trans, (filename,), filename, file_record(filename))
+            if cache:
+                print('Decode cache: {} hits, {} misses'.format(cache.hits, cache.misses), file=status)
+        finally: # keep the translations done so far
+            if cache:
+                cache.close()
+    if ndjson_writer:
+        ndjson_writer.close()
+    stats = LAYOUT_CACHE.stats()
+    if stats['hits'] + stats['misses'] > 0: # text mode and cache hits do not use the layout cache
+        print('Layout cache: {} hits, {} misses, {} evictions'.format(stats['hits'], stats['misses'], stats['evictions']), file=status)
+    if gpx_writer:
+        gpx_writer.close()
+        print('Wrote {} track points to {}'.format(gpx_writer.points, output_file), file=status)
+    if partitions is not None:
+        for filename, points in write_partitioned_gpx(partitions, output_file, jobs=jobs):
+            print('Wrote {} track points to {}'.format(points, filename), file=status)
     return
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('filenames', nargs='+', help='Files to translate')
+    parser.add_argument('filenames', nargs='*', help='Files to translate')
     parser.add_argument('-i', '--imap', required=False, action='store_true', default=False, help='Query imap server instead of reading local files. filenames argument will be interpreted as ini file.')
     parser.add_argument('-a', '--all', required=False, action='store_true', default=False, help='Retrieve all messages, not only unread ones. Only relevant in combination with -i.')
     parser.add_argument('-o', '--output', required=False, default=None, help='Optional output GPX file')
+    parser.add_argument('-p', '--split', required=False, action='store_true', default=False, help='Write one GPX file per tracker (SOURCE or IMEI from the file name) with one track per UTC day. The -o argument is then a directory.')
+    parser.add_argument('--ndjson', required=False, default=None, metavar='FILE', help='Write the translated messages as NDJSON (one JSON object per line) to FILE instead of printing them. Use - for stdout; status messages then go to stderr. In bulk mode, this replaces -o.')
+    parser.add_argument('-w', '--watch', required=False, action='store_true', default=False, help='Keep the IMAP connection open and translate new messages as soon as they arrive, using IDLE. Only relevant in combination with -i; requires a state entry in the ini file.')
+    parser.add_argument('-r', '--archive', required=False, action='store_true', default=False, help='Read files as archives of length-prefixed messages instead of one message per file.')
+    parser.add_argument('-s', '--stream', required=False, action='store_true', default=False, help='Read files as raw byte streams (e.g. serial captures), searching for valid messages anywhere in the data.')
+    parser.add_argument('-t', '--text', required=False, default=None, metavar='MOFIELDS', help='Read files as text messages with the fields selected by MOFIELDS, given as 24 hex digits as in text messages (e.g. 000f00000000000000000000).')
+    parser.add_argument('-b', '--bulk', required=False, action='store_true', default=False, help='Bulk mode: filenames are directories, searched recursively for .sbd and .bin files which are translated in parallel and written to the -o file.')
+    parser.add_argument('-m', '--mail-export', required=False, action='store_true', default=False, help='Bulk mode for mail exports: filenames are mbox files or Maildir directories. The .sbd and .bin attachments of all mails from --from are translated in parallel and written to the -o file.')
+    parser.add_argument('--from', required=False, default='@rockblock.rock7.com', dest='from_address', help='Sender address to filter the mails for with -m (default: @rockblock.rock7.com). Use an empty string for all mails.')
+    parser.add_argument('-u', '--unique', required=False, action='store_true', default=False, help='With -m, write each IMEI and MOMSN only once, e.g. if the export holds the same mail in several folders.')
+    parser.add_argument('-f', '--format', required=False, default=None, choices=['ndjson', 'csv', 'gpx'], help='Output format in bulk mode (default: from the -o file extension)')
+    parser.add_argument('-j', '--jobs', required=False, type=int, default=None, help='Number of worker processes in bulk mode and with -p (default: number of CPUs)')
+    parser.add_argument('-q', '--quality', required=False, action='store_true', default=False, help='In bulk mode, leave out messages with quality flags (positions out of range or 0, no fix, high PDOP, impossible speed, time regressions).')
+    parser.add_argument('-c', '--cache', required=False, default=None, help='Optional SQLite file caching translated files between runs, so only new or changed files are translated. Used for local files and in bulk mode (not with -m).')
+    parser.add_argument('--compact-cache', required=False, action='store_true', default=False, help='Remove entries of deleted files from the -c cache file, shrink it and exit.')
+    parser.add_argument('--cache-max-age', required=False, type=float, default=None, help='With --compact-cache, also remove entries not used for this many days.')
     args = parser.parse_args()
-    if args.imap:
-        assert (len(args.filenames) == 1), 'In combination with the -i option, exactly one file name must be given, namely the ini file.'
-    main(args.filenames, use_imap=args.imap, all_messages=args.all, output_file=args.output)
+    assert (not (args.mail_export and args.cache)), 'The -c option caches SBD files and cannot be combined with -m.'
+    if args.compact_cache:
+        assert (args.cache is not None), 'The --compact-cache option requires a cache file (-c).'
+        with DecodeCache(args.cache) as cache:
+            print('Evicted {} entries from {}'.format(cache.compact(max_age_days=args.cache_max_age), args.cache))
+    elif (args.bulk or args.mail_export) and args.ndjson:
+        bulk_main(args.filenames, args.ndjson, output_format='ndjson', jobs=args.jobs, cache_file=args.cache, quality=args.quality,
+                  mail_export=args.mail_export, from_address=args.from_address, unique=args.unique)
+    elif args.bulk or args.mail_export:
+        assert (args.output is not None), 'The -b and -m options require an output file (-o or --ndjson).'
+        bulk_main(args.filenames, args.output, output_format=args.format, jobs=args.jobs, cache_file=args.cache, split=args.split,
+                  quality=args.quality, mail_export=args.mail_export, from_address=args.from_address, unique=args.unique)
+    else:
+        assert (len(args.filenames) > 0), 'No files to translate given.'
+        if args.imap:
+            assert (len(args.filenames) == 1), 'In combination with the -i option, exactly one file name must be given, namely the ini file.'
+        main(args.filenames, use_imap=args.imap, all_messages=args.all, output_file=args.output, archive=args.archive, stream=args.stream, cache_file=args.cache,
+             split=args.split, jobs=args.jobs, text_mofields=args.text, ndjson_file=args.ndjson, watch=args.watch)
@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the Artemis Global Tracker Message Translator
+
+License: MIT
+
+Generates reproducible corpora of binary and text messages, with different MOFIELDS
+mixes, gateway headers and corruption rates, and measures messages per second, bytes
+per second and peak memory of each decoder entry point, including the Mapper's
+np.loadtxt path. The results can be saved as JSON to track regressions between releases.
+
+With -m, compares the memory used to keep translated messages in RAM as dictionaries
+(translate_sbd) and as TrackerMessage records (translate_sbd_message) instead.
+Messages are then read from the given SBD files, or a synthetic message is used.
+
+With -i, measures messages per second, round trips and bytes per message of each IMAP
+fetch strategy against the local IMAP stand-in server, so no mail provider is needed.
+"""
+
+import datetime
+import time
+import io
+import os
+import sys
+import json
+import math
+import email
+import email.message
+import platform
+import tempfile
+import contextlib
+import tracemalloc
+import argparse
+import asyncio
+import imaplib
+import configparser
+import numpy as np
+import Artemis_Global_Tracker_Message_Translator as agt
+import Artemis_Global_Tracker_IMAP_Stand_In as stand_in
+
+def synthetic_message():
+    """
+    Returns:
+        message, a typical MO message with date, position and environmental data
+    """
+    return agt.encode_sbd({
+        'SWVER': 0x12, 'BATTV': 4.12, 'PRESS': 1013, 'TEMP': 21.5, 'HUMID': 45.2,
+        'DATETIME': datetime.datetime(2021, 5, 7, 12, 34, 56),
+        'LAT': 55.0123456, 'LON': -1.456789, 'ALT': 123.456, 'SPEED': 1234, 'HEAD': 180.0,
+        'SATS': 11, 'PDOP': 1.23, 'FIX': 3, 'MOFIELDS': (0x0003ff00, 0, 0)})
+
+def measure_memory(translate, messages):
+    """
+    Measure the memory held by a list of translated messages.
+
+    Args:
+        translate, translation function
+        messages, list of binary messages
+
+    Returns:
+        size, allocated bytes per message
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    translated = [translate(message) for message in messages]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del translated
+    return size / len(messages)
+
+def memory_benchmark(messages):
+    """
+    Compare the memory used by dictionaries and TrackerMessage records.
+
+    Args:
+        messages, list of binary messages
+
+    Returns:
+        results, dictionary of bytes per message by representation
+    """
+    return {'dict': measure_memory(agt.translate_sbd, messages),
+            'TrackerMessage': measure_memory(agt.translate_sbd_message, messages)}
+
+"""
+MOFIELDS mixes of the synthetic corpora, by name.
+'default' is the tracker's default setting, 'mapper' the fields the Mapper expects.
+"""
+MOFIELDS_MIXES = {
+        'default': ['DATETIME', 'LAT', 'LON', 'ALT'],
+        'mapper': ['DATETIME', 'LAT', 'LON', 'ALT', 'SPEED', 'HEAD'],
+        'environment': ['SWVER', 'BATTV', 'PRESS', 'TEMP', 'HUMID', 'DATETIME', 'LAT', 'LON', 'ALT',
+                        'SPEED', 'HEAD', 'SATS', 'PDOP', 'FIX'],
+        'full': [field.name for field in agt.mofields_field_ids((0xffffffff, 0xffffffff, 0xffffffff))]
+}
+
+"""
+Value ranges (in the units of translate_sbd_batch) of fields whose full binary range would not be realistic.
+"""
+VALUE_RANGES = {
+        'LAT': (-90.0, 90.0), 'LON': (-180.0, 180.0), 'ALT': (-100.0, 15000.0), 'SPEED': (0, 100000),
+        'HEAD': (0.0, 214.0), 'BATTV': (3.0, 5.5), 'PRESS': (300, 1100), 'TEMP': (-40.0, 85.0),
+        'HUMID': (0.0, 100.0), 'SATS': (0, 30), 'PDOP': (0.5, 20.0), 'FIX': (0, 5),
+        'GEOF1LAT': (-90.0, 90.0), 'GEOF2LAT': (-90.0, 90.0), 'GEOF3LAT': (-90.0, 90.0), 'GEOF4LAT': (-90.0, 90.0),
+        'GEOF1LON': (-180.0, 180.0), 'GEOF2LON': (-180.0, 180.0), 'GEOF3LON': (-180.0, 180.0), 'GEOF4LON': (-180.0, 180.0)
+}
+
+def mofields_words(fields):
+    """
+    Returns:
+        mofields, the three uint32 MOFIELDS values selecting the given field names
+    """
+    words = [0, 0, 0]
+    for name in fields:
+        value = agt.TrackerMessageFields[name].value
+        words[value // 32] |= 1 << (31 - value % 32)
+    return tuple(words)
+
+def random_columns(fields, num, rng):
+    """
+    Draw random field values.
+
+    Args:
+        fields, list of field names
+        num, number of messages
+        rng, numpy.random.Generator
+
+    Returns:
+        columns, dictionary of arrays in the units of translate_sbd_batch()
+    """
+    columns = {}
+    for name in fields:
+        decoder = agt.FIELD_DECODERS[agt.TrackerMessageFields[name].value]
+        if decoder.kind == agt.KIND_DATETIME:
+            start = np.datetime64('2021-01-01T00:00:00')
+            columns[name] = start + np.sort(rng.integers(0, 365 * 86400, num)).astype('timedelta64[s]')
+        elif name == 'MOFIELDS':
+            columns[name] = np.tile(np.array(mofields_words(fields), dtype=np.uint32), (num, 1))
+        elif decoder.kind == agt.KIND_ARRAY:
+            info = np.iinfo(decoder.dtype)
+            columns[name] = rng.integers(info.min, info.max, (num, decoder.length // decoder.dtype.itemsize),
+                                         dtype=decoder.dtype, endpoint=True)
+        elif decoder.dtype.kind == 'f':
+            columns[name] = rng.uniform(-1000.0, 1000.0, num).astype(decoder.dtype)
+        elif name in VALUE_RANGES:
+            low, high = VALUE_RANGES[name]
+            if decoder.scale:
+                columns[name] = np.round(rng.uniform(low, high, num) / decoder.scale) * decoder.scale
+            else:
+                columns[name] = rng.integers(low, high, num, endpoint=True).astype(decoder.dtype)
+        else:
+            info = np.iinfo(decoder.dtype)
+            values = rng.integers(info.min, info.max, num, dtype=decoder.dtype, endpoint=True)
+            columns[name] = values * decoder.scale if decoder.scale else values
+    return columns
+
+def _text_formatter(name):
+    """
+    Returns:
+        format, function formatting one value of the field like the tracker does in text messages
+    """
+    field = agt.TrackerMessageFields[name]
+    decoder = agt.FIELD_DECODERS[field.value]
+    if field == agt.TrackerMessageFields.DATETIME:
+        return lambda value: str(value).replace('-', '').replace('T', '').replace(':', '')
+    if field in agt.TEXT_HEX_FIELDS:
+        dtype = decoder.dtype.newbyteorder('<')
+        return lambda value: np.asarray(value, dtype=dtype).tobytes().hex().upper()
+    if field in agt.TEXT_NIBBLE_FIELDS:
+        return lambda value: '{}.{}'.format(value >> 4, value & 0x0f)
+    if field in agt.TEXT_CONVERSION_FACTOR:
+        factor = agt.TEXT_CONVERSION_FACTOR[field]
+        return lambda value: '{:.{}f}'.format(value * factor, round(-math.log10(factor)))
+    if decoder.scale:
+        return lambda value: '{:.{}f}'.format(value, round(-math.log10(decoder.scale)))
+    if decoder.dtype.kind == 'f':
+        return lambda value: '{:.3f}'.format(value)
+    return lambda value: '{}'.format(value)
+
+def _headers(num, header_rate, rng):
+    """
+    Returns:
+        has_header, boolean array, True for messages with a gateway header
+        serials, RockBLOCK serial numbers for the gateway headers
+    """
+    return rng.random(num) < header_rate, rng.integers(10000, 1 << 20, num)
+
+def _corrupt(messages, corruption_rate, rng, replacement=None):
+    """
+    Corrupt one random byte in a fraction of the messages.
+
+    Args:
+        messages, list of byte arrays, changed in place
+        corruption_rate, fraction of messages to corrupt
+        rng, numpy.random.Generator
+        replacement, byte value to write (default: a random change of the original byte)
+    """
+    for ind in np.flatnonzero(rng.random(len(messages)) < corruption_rate):
+        message = bytearray(messages[ind])
+        pos = int(rng.integers(len(message)))
+        message[pos] = replacement if replacement is not None else message[pos] ^ int(rng.integers(1, 256))
+        messages[ind] = bytes(message)
+
+def binary_corpus(fields, num, header_rate=0.0, corruption_rate=0.0, seed=0):
+    """
+    Generate binary MO messages.
+
+    Args:
+        fields, list of field names
+        num, number of messages
+        header_rate, fraction of messages with a gateway header
+        corruption_rate, fraction of messages with one corrupted byte
+        seed, seed of the random number generator
+
+    Returns:
+        messages, list of bytes
+        columns, the encoded field values
+    """
+    rng = np.random.default_rng(seed)
+    columns = random_columns(fields, num, rng)
+    has_header, serials = _headers(num, header_rate, rng)
+    plain = agt.encode_sbd_batch(columns)
+    with_header = agt.encode_sbd_batch(columns, header=serials)
+    messages = [bytes(with_header[ind] if has_header[ind] else plain[ind]) for ind in range(num)]
+    _corrupt(messages, corruption_rate, rng)
+    return messages, columns
+
+def text_corpus(fields, num, header_rate=0.0, corruption_rate=0.0, seed=0):
+    """
+    Generate text MO messages, formatted like the tracker does.
+
+    Args:
+        fields, list of field names
+        num, number of messages
+        header_rate, fraction of messages with a gateway header
+        corruption_rate, fraction of messages with one character replaced by '#'
+        seed, seed of the random number generator
+
+    Returns:
+        messages, list of bytes
+        mofields, MOFIELDS setting as 24 hex digits
+    """
+    rng = np.random.default_rng(seed)
+    selected = [field.name for field in agt.mofields_field_ids(mofields_words(fields))]
+    columns = random_columns(selected, num, rng)
+    has_header, serials = _headers(num, header_rate, rng)
+    formatters = [(columns[name], _text_formatter(name)) for name in selected]
+    messages = []
+    for ind in range(num):
+        text = ','.join(formatter(column[ind]) for column, formatter in formatters)
+        if has_header[ind]:
+            text = 'RB{:07d},'.format(serials[ind]) + text
+        messages.append(text.encode('ascii'))
+    _corrupt(messages, corruption_rate, rng, replacement=ord('#'))
+    mofields = np.array(mofields_words(selected), dtype='<u4').tobytes().hex()
+    return messages, mofields
+
+def mail_corpus(messages, imei='300434063012345'):
+    """
+    Wrap binary messages into emails as sent by the RockBLOCK gateway, one attachment per email.
+
+    Returns:
+        mails, list of raw RFC822 emails as bytes
+    """
+    mails = []
+    for momsn, message in enumerate(messages):
+        mail = email.message.EmailMessage()
+        mail['From'] = 'sbdservice@rockblock.rock7.com'
+        mail['To'] = 'tracker@example.com'
+        mail['Subject'] = 'Message {} from RockBLOCK {}'.format(momsn, imei)
+        mail.set_content('Momsn: {}\nTransmit Time: 2021-05-07T12:34:56Z UTC\n'.format(momsn))
+        mail.add_attachment(message, maintype='application', subtype='octet-stream',
+                            filename='{}-{}.sbd'.format(imei, momsn))
+        mails.append(mail.as_bytes())
+    return mails
+
+def _translate_each(translate, messages):
+    """
+    Translate message by message, skipping invalid ones like main() does.
+    """
+    count = 0
+    for message in messages:
+        try:
+            translate(message)
+            count += 1
+        except (ValueError, AssertionError, IndexError):
+            pass
+    return count
+
+def _read_archive(messages):
+    """
+    Write the messages into a temporary archive, then time reading it back.
+    """
+    fd, filename = tempfile.mkstemp(suffix='.arc')
+    os.close(fd)
+    agt.write_archive(filename, messages)
+    def run():
+        return sum(1 for _ in agt.read_archive(filename))
+    return run, filename
+
+def _get_messages(mails):
+    """
+    The work get_messages() does per email once it is fetched: parse, extract attachments, translate.
+    """
+    count = 0
+    for raw_message in mails:
+        for sbd in agt.sbd_attachments(email.message_from_bytes(raw_message)):
+            try:
+                agt.translate_sbd(sbd)
+                count += 1
+            except (ValueError, AssertionError, IndexError):
+                pass
+    return count
+
+def mapper_loadtxt(messages):
+    """
+    The Mapper's decoding: one np.loadtxt call per message (the Mapper reads one file per message),
+    retried with shifted columns for messages with a gateway header. The Mapper's date converter
+    (matplotlib.dates.datestr2num) is replaced by datetime.strptime, so matplotlib is not needed.
+    """
+    def to_num(text):
+        text = text.decode() if isinstance(text, bytes) else text
+        return datetime.datetime.strptime(text, '%Y%m%d%H%M%S').timestamp() / 86400.0
+    count = 0
+    for message in messages:
+        try:
+            np.loadtxt(io.BytesIO(message), delimiter=',', unpack=True, usecols=(0, 1, 2, 3, 4, 5), converters={0: to_num})
+            count += 1
+        except ValueError:
+            try:
+                np.loadtxt(io.BytesIO(message), delimiter=',', unpack=True, usecols=(1, 2, 3, 4, 5, 6), converters={1: to_num})
+                count += 1
+            except ValueError:
+                pass
+    return count
+
+def measure(run, num, size, repeat=3):
+    """
+    Time a benchmark function and measure its peak memory.
+    Anything the entry points print (e.g. errors for corrupted messages) is discarded.
+
+    Args:
+        run, function without arguments processing the corpus
+        num, number of messages in the corpus
+        size, number of bytes in the corpus
+        repeat, number of timed runs; the fastest one is reported
+
+    Returns:
+        result, dictionary with seconds, msgs_per_s, bytes_per_s and peak_memory (bytes allocated on top of the corpus)
+    """
+    seconds = math.inf
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            seconds = min(seconds, time.perf_counter() - start)
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {'seconds': seconds, 'msgs_per_s': num / seconds, 'bytes_per_s': size / seconds, 'peak_memory': peak}
+
+def throughput_benchmark(num=10000, mixes=None, header_rate=0.5, corruption_rates=(0.0, 0.05), seed=0, repeat=3):
+    """
+    Run all decoder entry points on all corpora.
+
+    Args:
+        num, number of messages per corpus
+        mixes, names of the MOFIELDS_MIXES to use (default: all)
+        header_rate, fraction of messages with a gateway header
+        corruption_rates, corruption rates to generate corpora for
+        seed, seed of the random number generator
+        repeat, number of timed runs per entry point
+
+    Returns:
+        results, list of dictionaries, one per entry point and corpus
+    """
+    results = []
+    def report(entry, fmt, mix, corruption_rate, messages, run):
+        size = sum(len(message) for message in messages)
+        result = {'entry': entry, 'format': fmt, 'mix': mix, 'header_rate': header_rate,
+                  'corruption_rate': corruption_rate, 'messages': len(messages), 'bytes': size}
+        result.update(measure(run, len(messages), size, repeat=repeat))
+        results.append(result)
+        print('{:<22} {:<6} {:<12} {:5.2f} {:12.0f} msg/s {:10.2f} MB/s {:10.1f} kB peak'.format(
+            entry, fmt, mix, corruption_rate, result['msgs_per_s'], result['bytes_per_s'] / 1e6, result['peak_memory'] / 1e3))
+    for mix in (mixes or MOFIELDS_MIXES):
+        fields = MOFIELDS_MIXES[mix]
+        for corruption_rate in corruption_rates:
+            messages, columns = binary_corpus(fields, num, header_rate, corruption_rate, seed)
+            stream = b''.join(messages)
+            report('checksum', 'binary', mix, corruption_rate, messages, lambda: [agt.checksum(message) for message in messages])
+            report('checksum_batch', 'binary', mix, corruption_rate, messages, lambda: agt.checksum_batch(messages))
+            report('translate_sbd', 'binary', mix, corruption_rate, messages, lambda: _translate_each(agt.translate_sbd, messages))
+            report('translate_sbd_message', 'binary', mix, corruption_rate, messages,
+                   lambda: _translate_each(agt.translate_sbd_message, messages))
+            report('translate_sbd_batch', 'binary', mix, corruption_rate, messages, lambda: agt.translate_sbd_batch(messages))
+            report('StreamDecoder', 'binary', mix, corruption_rate, messages, lambda: sum(1 for _ in agt.decode_stream([stream])))
+            run, filename = _read_archive(messages)
+            try:
+                report('read_archive', 'binary', mix, corruption_rate, messages, run)
+            finally:
+                os.remove(filename)
+            mails = mail_corpus(messages)
+            report('get_messages', 'mail', mix, corruption_rate, mails, lambda: _get_messages(mails))
+            report('encode_sbd_batch', 'binary', mix, corruption_rate, messages, lambda: agt.encode_sbd_batch(columns))
+            texts, mofields = text_corpus(fields, num, header_rate, corruption_rate, seed)
+            report('translate_text_batch', 'text', mix, corruption_rate, texts, lambda: agt.translate_text_batch(texts, mofields))
+            if mix == 'mapper':
+                report('mapper_loadtxt', 'text', mix, corruption_rate, texts, lambda: mapper_loadtxt(texts))
+    return results
+
+def _fetch_each(imap, state, batch_size):
+    """
+    query_mail() as it was before batching: one FETCH command per mail. The baseline of the IMAP benchmark.
+    """
+    imap.select('Inbox')
+    _, data = imap.search(None, 'FROM', '@rockblock.rock7.com', '(UNSEEN)')
+    for num in data[0].split():
+        _, response = imap.fetch(num, '(RFC822)')
+        yield from agt.sbd_attachments(email.message_from_bytes(response[0][1]))
+
+"""
+IMAP fetch strategies, by name: function of (imap, MailSyncState, batch size) returning the attachments,
+and whether the mailbox is synced once before the timed run (to measure a run without new mails).
+"""
+IMAP_STRATEGIES = {
+        'fetch each (baseline)': (_fetch_each, False),
+        'query_mail': (lambda imap, state, batch_size: agt.query_mail(imap, batch_size=batch_size), False),
+        'query_mail attachments_only': (lambda imap, state, batch_size:
+                                        agt.query_mail(imap, batch_size=batch_size, attachments_only=True), False),
+        'sync_mail': (lambda imap, state, batch_size: agt.sync_mail(imap, state, 'bench', batch_size=batch_size), False),
+        'sync_mail attachments_only': (lambda imap, state, batch_size:
+                                       agt.sync_mail(imap, state, 'bench', batch_size=batch_size, attachments_only=True), False),
+        'sync_mail, no new mails': (lambda imap, state, batch_size: agt.sync_mail(imap, state, 'bench', batch_size=batch_size), True)
+}
+
+def imap_benchmark(num=2000, delay=0.01, batch_size=agt.IMAP_FETCH_BATCH, mailboxes=4, seed=0):
+    """
+    Fetch and translate synthetic RockBLOCK mails from the local IMAP stand-in server with each fetch strategy.
+
+    Every run connects, logs in, fetches, translates and logs out; round trips are the IMAP commands
+    of the run. Finally, the mails are spread over several stand-in servers and read with
+    ingest_mailboxes(), all at the same time. The servers run in their own processes.
+
+    Args:
+        num, number of mails
+        delay, simulated round trip time in s, added to every command
+        batch_size, number of mails per FETCH command
+        mailboxes, number of mailboxes for ingest_mailboxes()
+        seed, seed of the random number generator
+
+    Returns:
+        results, list of dictionaries, one per strategy
+    """
+    messages, _ = binary_corpus(MOFIELDS_MIXES['default'], num, seed=seed)
+    mails = mail_corpus(messages)
+    results = []
+    def report(strategy, count, seconds, commands, bytes_sent):
+        results.append({'entry': 'imap', 'strategy': strategy, 'delay': delay, 'batch_size': batch_size, 'mails': num,
+                        'messages': count, 'seconds': seconds, 'msgs_per_s': count / seconds, 'round_trips': commands,
+                        'round_trips_per_msg': commands / count if count else None,
+                        'bytes_per_msg': bytes_sent / count if count else None})
+        if count:
+            print('{:<30} {:7d} msgs {:10.0f} msg/s {:7d} round trips {:8.3f} per msg {:8.2f} kB per msg'.format(
+                  strategy, count, count / seconds, commands, commands / count, bytes_sent / count / 1e3))
+        else:
+            print('{:<30} {:7d} msgs {:>16} {:7d} round trips {:>12} {:8.2f} kB in total'.format(
+                  strategy, count, '', commands, '', bytes_sent / 1e3))
+    with stand_in.StandInProcess(mails, delay=delay) as server, tempfile.TemporaryDirectory() as tmp:
+        for ind, (strategy, (fetch, prime)) in enumerate(IMAP_STRATEGIES.items()):
+            server.reset_flags()
+            with agt.MailSyncState(os.path.join(tmp, '{}.sqlite'.format(ind))) as state:
+                if prime:
+                    imap = imaplib.IMAP4(*server.address)
+                    imap.login('user', 'password')
+                    for _ in fetch(imap, state, batch_size):
+                        pass
+                    imap.logout()
+                server.reset_stats()
+                start = time.perf_counter()
+                imap = imaplib.IMAP4(*server.address)
+                imap.login('user', 'password')
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    count = _translate_each(agt.translate_sbd, fetch(imap, state, batch_size))
+                imap.logout()
+                report(strategy, count, time.perf_counter() - start, *server.stats())
+    servers = [stand_in.StandInProcess(mails[ind::mailboxes], delay=delay) for ind in range(mailboxes)]
+    try:
+        config = configparser.ConfigParser()
+        for ind, server in enumerate(servers):
+            host, port = server.address
+            config['email:{}'.format(ind)] = {'host': host, 'port': str(port), 'ssl': 'no', 'user': 'user',
+                                              'password': 'password', 'batch': str(batch_size)}
+        count = [0]
+        def handle(name, msg):
+            count[0] += 1
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            asyncio.run(agt.ingest_mailboxes(agt.mail_sections(config), handle))
+        stats = [server.stats() for server in servers]
+        report('ingest_mailboxes x{}'.format(mailboxes), count[0], time.perf_counter() - start,
+               sum(commands for commands, _ in stats), sum(bytes_sent for _, bytes_sent in stats))
+    finally:
+        for server in servers:
+            server.stop()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filenames', nargs='*', help='SBD files to use with -m (default: a synthetic message)')
+    parser.add_argument('-m', '--memory', required=False, action='store_true', default=False, help='Compare the memory used by dictionaries and TrackerMessage records instead of running the throughput benchmarks.')
+    parser.add_argument('-n', '--count', required=False, type=int, default=None, help='Number of messages per corpus (default: 10000), to keep in memory with -m (default: 100000), or of mails with -i (default: 2000)')
+    parser.add_argument('-i', '--imap', required=False, action='store_true', default=False, help='Benchmark the IMAP fetch strategies against the local IMAP stand-in server instead of the decoders.')
+    parser.add_argument('--delay', required=False, type=float, default=0.01, help='Simulated round trip time of the IMAP stand-in server in s (default: 0.01)')
+    parser.add_argument('--batch', required=False, type=int, default=agt.IMAP_FETCH_BATCH, help='Mails per FETCH command with -i (default: {})'.format(agt.IMAP_FETCH_BATCH))
+    parser.add_argument('--mailboxes', required=False, type=int, default=4, help='Number of mailboxes for ingest_mailboxes with -i (default: 4)')
+    parser.add_argument('-x', '--mix', required=False, action='append', choices=list(MOFIELDS_MIXES), help='MOFIELDS mix to benchmark, can be given several times (default: all)')
+    parser.add_argument('--header-rate', required=False, type=float, default=0.5, help='Fraction of messages with a gateway header (default: 0.5)')
+    parser.add_argument('--corruption-rate', required=False, type=float, action='append', help='Fraction of corrupted messages, can be given several times (default: 0 and 0.05)')
+    parser.add_argument('--seed', required=False, type=int, default=0, help='Seed for the synthetic corpora (default: 0)')
+    parser.add_argument('-r', '--repeat', required=False, type=int, default=3, help='Timed runs per benchmark; the fastest is reported (default: 3)')
+    parser.add_argument('-o', '--output', required=False, default=None, help='Optional JSON file to save the results to')
+    args = parser.parse_args()
+    if args.memory:
+        samples = []
+        for filename in args.filenames:
+            with open(filename, 'rb') as fd:
+                samples.append(fd.read())
+        if not samples:
+            samples = [synthetic_message()]
+        # bytearray copies, so that records cannot share the bytes objects of the input
+        messages = [bytearray(samples[ind % len(samples)]) for ind in range(args.count or 100000)]
+        results = memory_benchmark(messages)
+        for name, size in results.items():
+            print('{:>15}: {:8.1f} bytes per message'.format(name, size))
+        print('{:>15}: {:8.2f}x'.format('ratio', results['dict'] / results['TrackerMessage']))
+    else:
+        if args.imap:
+            count = args.count or 2000
+            results = imap_benchmark(num=count, delay=args.delay, batch_size=args.batch, mailboxes=args.mailboxes, seed=args.seed)
+        else:
+            count = args.count or 10000
+            results = throughput_benchmark(num=count, mixes=args.mix, header_rate=args.header_rate,
+                                           corruption_rates=args.corruption_rate or (0.0, 0.05), seed=args.seed, repeat=args.repeat)
+        if args.output:
+            with open(args.output, 'w') as fd:
+                json.dump({'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                           'python': sys.version.split()[0], 'numpy': np.__version__, 'platform': platform.platform(),
+                           'count': count, 'seed': args.seed, 'results': results}, fd, indent=1)
+            print('Saved {} results to {}'.format(len(results), args.output))
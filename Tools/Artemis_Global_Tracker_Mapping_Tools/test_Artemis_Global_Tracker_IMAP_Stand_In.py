@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Regression tests for the IMAP stand-in server. Run with: python3 -m pytest
+"""
+
+import email.message
+import imaplib
+
+import Artemis_Global_Tracker_IMAP_Stand_In as stand_in
+
+
+def _mail(sender, num):
+    mail = email.message.EmailMessage()
+    mail['From'] = sender
+    mail['Subject'] = 'Message {}'.format(num)
+    mail.set_content('Momsn: {}\n'.format(num))
+    return mail.as_bytes()
+
+
+def test_search_filters():
+    """
+    SEARCH honours FROM, UNSEEN and UID ranges instead of returning every mail.
+    """
+    mails = [_mail('sbdservice@rockblock.rock7.com' if num % 2 else 'someone@example.com', num) for num in range(1, 7)]
+    with stand_in.StandInServer(stand_in.StandInMailbox(mails)) as server:
+        imap = imaplib.IMAP4(*server.address)
+        imap.login('user', 'password')
+        imap.select('Inbox')
+        assert imap.search(None, 'FROM', '@rockblock.rock7.com')[1] == [b'1 3 5']
+        assert imap.uid('SEARCH', 'UID', '4:*')[1] == [b'4 5 6']
+        assert imap.uid('SEARCH', 'UID', '4:*', 'FROM', '"@rockblock.rock7.com"')[1] == [b'5']
+        imap.fetch('1:2', '(RFC822)')
+        assert imap.search(None, '(UNSEEN)')[1] == [b'3 4 5 6']
+        imap.fetch('3', '(BODY.PEEK[])')
+        assert imap.search(None, 'FROM', '@rockblock.rock7.com', '(UNSEEN)')[1] == [b'3 5']
+        imap.logout()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Regression tests for the Message Translator. Run with: python3 -m pytest
+"""
+
+import datetime
+import email.message
+import email.policy
+import io
+import json
+import os
+import pickle
+import sqlite3
+import struct
+
+import numpy as np
+
+import Artemis_Global_Tracker_Message_Translator as agt
+import Artemis_Global_Tracker_Translator_Benchmark as benchmark
+
+
+def test_layout_cache_evicted_hint():
+    """
+    A hint pointing at an evicted layout must not be used.
+    """
+    cache = agt.LayoutCache(maxsize=1)
+    position = agt.encode_sbd({'LAT': 1.0, 'LON': 2.0})
+    battery = agt.encode_sbd({'BATTV': 4.1})
+    assert agt.translate_sbd(position, cache) == {'LAT': 1.0, 'LON': 2.0}
+    assert agt.translate_sbd(battery, cache) == {'BATTV': 4.1}
+    assert agt.translate_sbd(position, cache) == {'LAT': 1.0, 'LON': 2.0}
+    assert len(cache) == 1
+    assert cache.stats()['evictions'] == 2
+
+
+def _baseline_translate(message):
+    """
+    The field walk translate_sbd() did before layouts were compiled, kept as reference.
+    The checksum covers STX to ETX only, without the gateway header.
+    """
+    data = {}
+    start = 0 if message[0] == agt.TrackerMessageFields.STX.value else 5
+    assert (message[start] == agt.TrackerMessageFields.STX.value), 'STX marker not found.'
+    ind = start + 1
+    while (message[ind] != agt.TrackerMessageFields.ETX.value):
+        field = agt.TrackerMessageFields(message[ind])
+        ind += 1
+        field_type = agt.FIELD_TYPE[field]
+        if isinstance(field_type, int): # length in bytes
+            field_len = field_type
+            if field == agt.TrackerMessageFields.DATETIME:
+                data[field.name] = datetime.datetime(*struct.unpack('HBBBBB', message[ind:ind+field_len]))
+            elif field_len > 0:
+                data[field.name] = message[ind:ind+field_len]
+        elif isinstance(field_type, np.dtype): # dtype of scalar
+            field_len = field_type.itemsize
+            data[field.name] = np.frombuffer(message[ind:ind+field_len], dtype=field_type)[0]
+        else: # dtype and length of array
+            field_len = field_type[0].itemsize * field_type[1]
+            data[field.name] = np.frombuffer(message[ind:ind+field_len], dtype=field_type[0])
+        if field in agt.CONVERSION_FACTOR:
+            data[field.name] = float(data[field.name]) * agt.CONVERSION_FACTOR[field]
+        ind += field_len
+    ind += 1 # ETX
+    cs_a, cs_b = agt.checksum(message[start:ind])
+    assert (message[ind] == cs_a), 'Checksum mismatch.'
+    assert (message[ind+1] == cs_b), 'Checksum mismatch.'
+    return data
+
+
+def _assert_same_message(data, expected):
+    assert list(data) == list(expected)
+    for name, value in expected.items():
+        if isinstance(value, np.ndarray):
+            np.testing.assert_array_equal(data[name], value)
+        else:
+            assert data[name] == value, name
+
+
+def test_translate_sbd_matches_baseline():
+    """
+    The compiled layouts decode every field like the field-by-field walk did.
+    """
+    for mix in ('default', 'environment', 'full'):
+        messages, _ = benchmark.binary_corpus(benchmark.MOFIELDS_MIXES[mix], 50, header_rate=0.5, corruption_rate=0.2, seed=3)
+        cache = agt.LayoutCache()
+        for message in messages:
+            try:
+                expected = _baseline_translate(message)
+            except (ValueError, AssertionError, IndexError) as err: # the error may differ, e.g. the checksum is checked first now
+                try:
+                    agt.translate_sbd(message, cache)
+                except (ValueError, AssertionError, IndexError):
+                    pass
+                else:
+                    raise AssertionError('Invalid message was translated: {}'.format(err))
+                continue
+            _assert_same_message(agt.translate_sbd(message, cache), expected)
+            _assert_same_message(agt.translate_sbd_message(message, cache).as_dict(), expected)
+        assert cache.hits > 0
+
+
+def test_translate_sbd_batch_matches_scalar():
+    """
+    translate_sbd_batch() yields the same values and valid flags as translate_sbd() per message.
+    """
+    messages, _ = benchmark.binary_corpus(benchmark.MOFIELDS_MIXES['environment'], 200, header_rate=0.3, corruption_rate=0.1, seed=5)
+    messages += benchmark.binary_corpus(benchmark.MOFIELDS_MIXES['default'], 100, header_rate=0.3, seed=6)[0]
+    columns, valid = agt.translate_sbd_batch(messages)
+    for row, message in enumerate(messages):
+        try:
+            expected = agt.translate_sbd(message)
+        except (ValueError, AssertionError, IndexError):
+            assert not valid[row]
+            continue
+        assert valid[row]
+        for name, column in columns.items():
+            if name not in expected:
+                assert np.all(column.mask[row]), name
+            elif name == 'DATETIME':
+                assert column[row] == np.datetime64(expected[name], 's')
+            elif isinstance(expected[name], np.ndarray):
+                np.testing.assert_array_equal(column[row], expected[name])
+            else:
+                assert column[row] == expected[name], name
+
+
+def test_stream_decoder_resync():
+    """
+    Garbage between frames is skipped and counted, and frames split across chunks are decoded.
+    """
+    first = agt.encode_sbd({'LAT': 1.0, 'LON': 2.0})
+    second = agt.encode_sbd({'BATTV': 4.1}, header=12345)
+    third = agt.encode_sbd({'ALT': 100.0})
+    stream = b'noise' + first + second + b'\x02\x99garbage' + third + b'tail'
+    decoder = agt.StreamDecoder()
+    chunks = [stream[pos:pos+7] for pos in range(0, len(stream), 7)]
+    messages = list(agt.decode_stream(chunks, decoder))
+    assert messages == [{'LAT': 1.0, 'LON': 2.0}, {'BATTV': 4.1}, {'ALT': 100.0}]
+    assert decoder.stats() == {'messages': 3, 'resyncs': 3, 'skipped_bytes': 5 + 9 + 4, 'pending': 0}
+
+
+def test_checksum_with_gateway_header():
+    """
+    The checksum of a message with a gateway header covers STX to ETX, not the header.
+    """
+    plain = agt.encode_sbd({'LAT': 1.0, 'LON': 2.0})
+    message = agt.encode_sbd({'LAT': 1.0, 'LON': 2.0}, header=12345)
+    assert message == agt.gateway_header(12345) + plain
+    assert tuple(agt.checksum(message[5:-2])) == (message[-2], message[-1])
+    assert agt.translate_sbd(message) == agt.translate_sbd(plain) == {'LAT': 1.0, 'LON': 2.0}
+    corrupted = bytearray(message)
+    corrupted[8] ^= 0x01 # a bit of LAT, so only the checksum can tell
+    try:
+        agt.translate_sbd(bytes(corrupted))
+    except AssertionError as err:
+        assert str(err) == 'Checksum mismatch.'
+    else:
+        raise AssertionError('Corrupted message was translated')
+    columns, valid = agt.translate_sbd_batch([message, bytes(corrupted), plain])
+    assert valid.tolist() == [True, False, True]
+
+
+def test_tracker_message_pickle_keeps_projection():
+    """
+    A TrackerMessage decoded with fields= keeps only those fields when pickled.
+    """
+    message = agt.encode_sbd({'BATTV': 4.1, 'LAT': 1.0, 'LON': 2.0})
+    msg = agt.translate_sbd_message(message, fields=['LAT'])
+    copy = pickle.loads(pickle.dumps(msg))
+    assert list(copy) == ['LAT']
+    assert copy.as_dict() == msg.as_dict() == {'LAT': 1.0}
+    full = pickle.loads(pickle.dumps(agt.translate_sbd_message(message)))
+    assert full.as_dict() == agt.translate_sbd(message)
+
+
+def _reject_constant(name):
+    raise ValueError('{} is not valid JSON'.format(name))
+
+
+def test_ndjson_non_finite_floats(tmp_path):
+    """
+    NaN and infinity are written as null, so every NDJSON line is strict JSON.
+    """
+    filename = str(tmp_path / 'messages.ndjson')
+    with agt.NDJSONWriter(filename) as writer:
+        writer.write_message(agt.translate_sbd(agt.encode_sbd({'USERVAL7': float('nan'), 'USERVAL8': float('inf')})))
+        writer.write_message({'TEMP': float('-inf'), 'ARRAY': np.array([1.5, np.nan])})
+    with open(filename) as fd:
+        records = [json.loads(line, parse_constant=_reject_constant) for line in fd]
+    assert records == [{'USERVAL7': None, 'USERVAL8': None}, {'TEMP': None, 'ARRAY': [1.5, None]}]
+
+
+def test_decode_cache_round_trip(tmp_path):
+    """
+    Cached translations come back with the types translate_sbd() returns, and old pickled caches are discarded.
+    """
+    filename = str(tmp_path / '300434063012345-1.sbd')
+    message = agt.encode_sbd({'DATETIME': datetime.datetime(2021, 5, 7, 12, 34, 56), 'LAT': 47.3976123, 'BATTV': 4.1,
+                              'MOFIELDS': np.array([0x0f, 0, 0x20], dtype=np.uint32), 'GEOFSTAT': np.array([1, 2, 3], dtype=np.uint8),
+                              'RBHEAD': b'\x01\x02\x03\x04', 'USERVAL7': float('nan'), 'USERVAL8': 1.5})
+    with open(filename, 'wb') as fd:
+        fd.write(message)
+    cache_file = str(tmp_path / 'cache.sqlite')
+    with sqlite3.connect(cache_file) as db: # cache written by an older version, with pickled records
+        db.execute('CREATE TABLE decoded (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT, record BLOB, '
+                   'error TEXT, last_used REAL)')
+        db.execute('INSERT INTO decoded VALUES (?, 0, 0, "", ?, NULL, 0)', (os.path.abspath(filename), pickle.dumps({})))
+    db.close()
+    with agt.DecodeCache(cache_file) as cache:
+        assert cache.lookup(filename) is None
+        cache.store(filename, *agt.translate_file(filename))
+    with agt.DecodeCache(cache_file) as cache:
+        msg_trans, error = cache.lookup(filename)
+    expected = agt.translate_sbd(message)
+    assert error is None
+    assert list(msg_trans) == list(expected)
+    for name, value in expected.items():
+        assert type(msg_trans[name]) is type(value), name
+        if isinstance(value, np.ndarray):
+            assert msg_trans[name].dtype == value.dtype
+            np.testing.assert_array_equal(msg_trans[name], value)
+        elif name == 'USERVAL7':
+            assert np.isnan(msg_trans[name])
+        else:
+            assert msg_trans[name] == value, name
+
+
+def test_mail_export_crlf_and_duplicates(tmp_path):
+    """
+    mbox exports with CRLF line endings are read, and duplicate mails are only dropped when asked for.
+    """
+    mail = email.message.EmailMessage(policy=email.policy.SMTP)
+    mail['From'] = 'sbdservice@rockblock.rock7.com'
+    mail['Subject'] = 'Message 7 from RockBLOCK 300434063012345'
+    mail.set_content('Momsn: 7\n')
+    mail.add_attachment(agt.encode_sbd({'LAT': 1.0, 'LON': 2.0}), maintype='application', subtype='octet-stream',
+                        filename='300434063012345-7.sbd')
+    other = email.message.EmailMessage(policy=email.policy.SMTP)
+    other['From'] = 'someone@example.com'
+    other.set_content('Forwarded from sbdservice@rockblock.rock7.com\n')
+    filename = str(tmp_path / 'export.mbox')
+    with open(filename, 'wb') as fd:
+        for raw in (mail.as_bytes(), other.as_bytes(), mail.as_bytes()):
+            assert b'\r\n\r\n' in raw
+            fd.write(b'From MAILER-DAEMON Fri May  7 12:34:56 2021\r\n' + raw + b'\r\n')
+    assert not agt.mail_from_matches(other.as_bytes(), '@rockblock.rock7.com')
+    results, errors = agt.translate_mail_exports_parallel([filename], jobs=1, status=io.StringIO())
+    assert errors == []
+    assert [result[:3] for result in results] == [('300434063012345', 7, '300434063012345-7.sbd')] * 2
+    assert results[0][3] == {'LAT': 1.0, 'LON': 2.0}
+    status = io.StringIO()
+    results, errors = agt.translate_mail_exports_parallel([filename], jobs=1, unique=True, status=status)
+    assert len(results) == 1
+    assert 'Skipped 1 duplicate attachments' in status.getvalue()